@@ -92,6 +92,12 @@ class CE_OT_export_dae(bpy.types.Operator, ExportHelper):
         description="Export Triangles instead of Polygons.",
         default=False,
         )
+    use_vertex_welding : BoolProperty(
+        name="Weld Vertices",
+        description="Merge vertices whose attributes only differ by a "
+                    "tiny amount.",
+        default=False,
+        )
 
     use_copy_images : BoolProperty(
         name="Copy Images",
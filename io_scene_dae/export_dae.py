@@ -24,13 +24,17 @@ This script is an exporter to the Khronos Collada file format.
 http://www.khronos.org/collada/
 """
 
+import io
 import os
 import time
 import math
 import shutil
+import tempfile
 import bpy
 import bmesh
-from mathutils import Vector, Matrix
+import numpy as np
+from xml.sax.saxutils import escape
+from mathutils import Matrix
 from bpy_extras import node_shader_utils
 
 # According to collada spec, order matters
@@ -50,121 +54,359 @@ S_ANIM = 12
 
 CMP_EPSILON = 0.0001
 
+# Extra entities needed on top of &, < and > inside "quoted" attributes
+XML_ATTR_ENTITIES = {"\"": "&quot;"}
 
-def snap_tup(tup):
-    ret = ()
-    for x in tup:
-        ret += (x - math.fmod(x, 0.0001), )
+# Indentation prefixes, precomputed for the depths writel commonly sees.
+# The byte versions are appended to the sections as they are
+TABS = tuple("\t" * i for i in range(32))
+BYTE_TABS = tuple(t.encode("ascii") for t in TABS)
 
-    return tup
+# The document is written in a few very large chunks, a buffer much bigger
+# than the io default keeps that to few write calls
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Sections move their lines to a temporary file in chunks of this size,
+# which only goes to disk once it holds more than SECTION_SPOOL_SIZE
+SECTION_SPILL_SIZE = 1 << 20
+SECTION_SPOOL_SIZE = 64 << 20
+
+DOCUMENT_HEADER = (
+    b"<?xml version=\"1.0\" encoding=\"utf-8\"?>\n"
+    b"<COLLADA xmlns=\"http://www.collada.org/2005/11/COLLADASchema\" "
+    b"version=\"1.4.1\">\n")
+DOCUMENT_FOOTER = (
+    "<scene>\n"
+    "\t<instance_visual_scene url=\"#{}\" />\n"
+    "</scene>\n"
+    "</COLLADA>\n")
+
+
+def snap_tup(tup, eps=CMP_EPSILON):
+    """Quantize a tuple of floats to integer multiples of eps."""
+    return tuple(round(x / eps) for x in tup)
+
+
+def xmlattr(s):
+    """Escape a user provided name for a double quoted XML attribute."""
+    return escape(s, XML_ATTR_ENTITIES)
 
 
 def strmtx(mtx):
-    s = ""
-    for x in range(4):
-        for y in range(4):
-            s += "{} ".format(mtx[x][y])
-    s = " {} ".format(s)
-    return s
+    s = " ".join(str(mtx[x][y]) for x in range(4) for y in range(4))
+    return " {} ".format(s)
 
 
 def numarr(a, mult=1.0):
-    s = " "
-    for x in a:
-        s += " {}".format(x * mult)
-    s += " "
-    return s
+    return " {} ".format(" ".join(str(x * mult) for x in a))
 
 
 def numarr_alpha(a, mult=1.0):
-    s = " "
-    for x in a:
-        s += " {}".format(x * mult)
+    values = [str(x * mult) for x in a]
     if len(a) == 3:
-        s += " 1.0"
-    s += " "
-    return s
+        values.append("1.0")
+    return " {} ".format(" ".join(values))
 
 
 def strarr(arr):
-    s = " "
-    for x in arr:
-        s += " {}".format(x)
-    s += " "
-    return s
+    return " {} ".format(" ".join(str(x) for x in arr))
+
+
+def floatarr(arr):
+    """Format a float array as a space separated string.
+
+    The whole array is formatted by NumPy in one call. Nine significant
+    digits are enough for every float32 value to read back unchanged.
+    """
+    buf = io.StringIO()
+    np.savetxt(buf, np.reshape(arr, (1, -1)), fmt="%.9g", delimiter=" ",
+               newline="")
+    return buf.getvalue()
+
+
+def intarr(arr):
+    """Format an integer array as a space separated string.
+
+    A single % over the whole array is about twice as fast as joining the
+    str() of every value, which matters for index lists of large meshes.
+    """
+    values = np.ravel(arr).tolist()
+    return " ".join(["%d"] * len(values)) % tuple(values)
+
+
+def indented(lines):
+    """Join (indent, text) pairs into a block for writel(section, 0, ...)."""
+    return "\n".join(TABS[indent] + text for indent, text in lines)
+
+
+# Surface and sampler params for one texture of an effect
+EFFECT_SAMPLER = indented((
+    (3, "<newparam sid=\"{surface_sid}\">"),
+    (4, "<surface type=\"2D\">"),
+    (5, "<init_from>{imgid}</init_from>"),
+    (5, "<format>A8R8G8B8</format>"),
+    (4, "</surface>"),
+    (3, "</newparam>"),
+    (3, "<newparam sid=\"{sampler_sid}\">"),
+    (4, "<sampler2D>"),
+    (5, "<source>{surface_sid}</source>"),
+    (4, "</sampler2D>"),
+    (3, "</newparam>"),
+))
+
+EFFECT_TEXTURE = "<texture texture=\"{}\" texcoord=\"CHANNEL1\"/>"
+EFFECT_COLOR = "<color>{}</color>"
+EFFECT_BUMP = "\n" + indented((
+    (6, "<bump bumptype=\"NORMALMAP\">"),
+    (7, EFFECT_TEXTURE),
+    (6, "</bump>"),
+))
+
+# Everything after the samplers of an effect. Blender 2.8 removed the
+# world ambient color, material.specular_hardness, material.mirror_color
+# and material.specular_ior, so those are written as constants.
+# material.use_transparency and material.use_shadeless are gone too, which
+# drops <transparency> and the GODOT <unshaded> technique.
+EFFECT_TECHNIQUE = indented((
+    (3, "<technique sid=\"common\">"),
+    (4, "<blinn>"),
+    (5, "<emission>"),
+    (6, "{emission}"),
+    (5, "</emission>"),
+    (5, "<ambient>"),
+    (6, EFFECT_COLOR.format(numarr_alpha((0.0, 0.0, 0.0), 1.0))),
+    (5, "</ambient>"),
+    (5, "<diffuse>"),
+    (6, "{diffuse}"),
+    (5, "</diffuse>"),
+    (5, "<specular>"),
+    (6, "{specular}"),
+    (5, "</specular>"),
+    (5, "<shininess>"),
+    (6, "<float>50</float>"),
+    (5, "</shininess>"),
+    (5, "<reflective>"),
+    (6, EFFECT_COLOR.format(numarr_alpha((0.5, 0.5, 0.5)))),
+    (5, "</reflective>"),
+    (5, "<index_of_refraction>"),
+    (6, "<float>1.2</float>"),
+    (5, "</index_of_refraction>"),
+    (4, "</blinn>"),
+    (4, "<extra>"),
+    (5, "<technique profile=\"FCOLLADA\">{bump}"),
+    (5, "</technique>"),
+    (5, "<technique profile=\"GOOGLEEARTH\">"),
+    (6, "<double_sided>{double_sided}</double_sided>"),
+    (5, "</technique>"),
+    (4, "</extra>"),
+    (3, "</technique>"),
+    (2, "</profile_COMMON>"),
+    (1, "</effect>"),
+))
+
+# One sampled animation channel: time, output and interpolation sources,
+# then the sampler and the channel driving the target
+ANIMATION_CHANNEL = indented((
+    (1, "<animation id=\"{id}\">"),
+    (2, "<source id=\"{id}-input\">"),
+    (3, "<float_array id=\"{id}-input-array\" "
+        "count=\"{count}\">{times}</float_array>"),
+    (3, "<technique_common>"),
+    (4, "<accessor source=\"#{id}-input-array\" "
+        "count=\"{count}\" stride=\"1\">"),
+    (5, "<param name=\"TIME\" type=\"float\"/>"),
+    (4, "</accessor>"),
+    (3, "</technique_common>"),
+    (2, "</source>"),
+    (2, "<source id=\"{id}-transform-output\">"),
+    (3, "<float_array id=\"{id}-transform-output-array\" "
+        "count=\"{value_count}\">{values}</float_array>"),
+    (3, "<technique_common>"),
+    (4, "<accessor source=\"#{id}-transform-output-array\" "
+        "count=\"{count}\" stride=\"{stride}\">"),
+    (5, "{param}"),
+    (4, "</accessor>"),
+    (3, "</technique_common>"),
+    (2, "</source>"),
+    (2, "<source id=\"{id}-interpolation-output\">"),
+    (3, "<Name_array id=\"{id}-interpolation-output-array\" "
+        "count=\"{count}\">{interps}</Name_array>"),
+    (3, "<technique_common>"),
+    (4, "<accessor source=\"#{id}-interpolation-output-array\" "
+        "count=\"{count}\" stride=\"1\">"),
+    (5, "<param name=\"INTERPOLATION\" type=\"Name\"/>"),
+    (4, "</accessor>"),
+    (3, "</technique_common>"),
+    (2, "</source>"),
+    (2, "<sampler id=\"{id}-sampler\">"),
+    (3, "<input semantic=\"INPUT\" source=\"#{id}-input\"/>"),
+    (3, "<input semantic=\"OUTPUT\" source=\"#{id}-transform-output\"/>"),
+    (3, "<input semantic=\"INTERPOLATION\" "
+        "source=\"#{id}-interpolation-output\"/>"),
+    (2, "</sampler>"),
+    (2, "<channel source=\"#{id}-sampler\" target=\"{target}\"/>"),
+    (1, "</animation>"),
+))
+ANIMATION_PARAM_MATRIX = "<param name=\"TRANSFORM\" type=\"float4x4\"/>"
+ANIMATION_PARAM_VALUE = "<param name=\"X\" type=\"float\"/>"
+
+
+class VertexHash:
+    """Spatial hash used to weld vertices that are closer than an epsilon.
+
+    Cells are twice the epsilon wide and each row is registered in every
+    cell it may overlap, so two rows within epsilon always share a cell.
+    Cells are keyed by the tuple of their integer coordinates.
+
+    Rows are also snapped to a grid fine enough that rows snapping to the
+    same point are always within epsilon, which catches most duplicates
+    without a distance check.
+    """
+
+    __slots__ = ("eps_sq", "cell", "step", "snapped", "buckets", "rows")
+
+    def __init__(self, width, eps=CMP_EPSILON):
+        self.eps_sq = eps * eps
+        self.cell = 2.0 * eps
+        self.step = eps / math.sqrt(width)
+        self.snapped = {}
+        self.buckets = {}
+        self.rows = []
+
+    def cell_keys(self, row):
+        x = row[0] / self.cell
+        y = row[1] / self.cell
+        z = row[2] / self.cell
+        return {(kx, ky, kz)
+                for kx in (math.floor(x), math.ceil(x))
+                for ky in (math.floor(y), math.ceil(y))
+                for kz in (math.floor(z), math.ceil(z))}
+
+    def insert(self, row):
+        """Return the index of a row close to row, adding it if none is."""
+        snapped = snap_tup(row, self.step)
+        idx = self.snapped.get(snapped)
+        if (idx is not None):
+            return idx
+
+        keys = self.cell_keys(row)
+        for key in keys:
+            for idx in self.buckets.get(key, ()):
+                other = self.rows[idx]
+                dist_sq = 0.0
+                for a, b in zip(row, other):
+                    dist_sq += (a - b) * (a - b)
+                if dist_sq < self.eps_sq:
+                    return idx
+
+        idx = len(self.rows)
+        self.rows.append(row)
+        self.snapped[snapped] = idx
+        for key in keys:
+            self.buckets.setdefault(key, []).append(idx)
+        return idx
+
+
+class SectionBuffer:
+    """UTF-8 output of one document section.
+
+    Lines are encoded once, when writel appends them to a bytearray, which
+    it moves into a spooled temporary file whenever it grows past
+    SECTION_SPILL_SIZE. Huge scenes then don't need the whole document in
+    memory before it is written, and writing a section out is a plain copy
+    of bytes in document order.
+    """
+
+    __slots__ = ("data", "spool")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.spool = None
+
+    def spill(self):
+        if (self.spool is None):
+            self.spool = tempfile.SpooledTemporaryFile(
+                max_size=SECTION_SPOOL_SIZE)
+        self.spool.write(self.data)
+        del self.data[:]
+
+    def extend(self, other):
+        """Append the contents of another section and close it."""
+        if (other.spool is not None):
+            self.spill()
+            other.spool.seek(0)
+            shutil.copyfileobj(other.spool, self.spool, SECTION_SPILL_SIZE)
+        self.data += other.data
+        other.close()
+
+    def write_to(self, f):
+        if (self.spool is not None):
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, f, WRITE_BUFFER_SIZE)
+        f.write(self.data)
+
+    def close(self):
+        if (self.spool is not None):
+            self.spool.close()
+            self.spool = None
+        self.data = bytearray()
 
 
 class DaeExporter:
 
     def validate_id(self, d):
         if (d.find("id-") == 0):
-            return "z{}".format(d)
-        return d
+            return "z{}".format(xmlattr(d))
+        return xmlattr(d)
 
     def new_id(self, t):
         self.last_id += 1
         return "id-{}-{}".format(t, self.last_id)
 
-    class Vertex:
-
-        def close_to(self, v):
-            if self.vertex - v.vertex.length() > CMP_EPSILON:
-                return False
-            if self.normal - v.normal.length() > CMP_EPSILON:
-                return False
-            if self.uv - v.uv.length() > CMP_EPSILON:
-                return False
-            if self.uv2 - v.uv2.length() > CMP_EPSILON:
-                return False
-
-            return True
-
-        def get_tup(self):
-            tup = (self.vertex.x, self.vertex.y, self.vertex.z, self.normal.x,
-                   self.normal.y, self.normal.z)
-            for t in self.uv:
-                tup = tup + (t.x, t.y)
-            if self.color is not None:
-                tup = tup + (self.color.x, self.color.y, self.color.z)
-            if self.tangent is not None:
-                tup = tup + (self.tangent.x, self.tangent.y, self.tangent.z)
-            if self.bitangent is not None:
-                tup = tup + (self.bitangent.x, self.bitangent.y,
-                             self.bitangent.z)
-            for t in self.bones:
-                tup = tup + (float(t), )
-            for t in self.weights:
-                tup = tup + (float(t), )
-
-            return tup
-
-        __slots__ = ("vertex", "normal", "tangent", "bitangent", "color", "uv",
-                     "uv2", "bones", "weights")
-
-        def __init__(self):
-            self.vertex = Vector((0.0, 0.0, 0.0))
-            self.normal = Vector((0.0, 0.0, 0.0))
-            self.tangent = None
-            self.bitangent = None
-            self.color = None
-            self.uv = []
-            self.uv2 = Vector((0.0, 0.0))
-            self.bones = []
-            self.weights = []
-
     def writel(self, section, indent, text):
-        if (not (section in self.sections)):
-            self.sections[section] = []
-        line = "{}{}".format(indent * "\t", text)
-        self.sections[section].append(line)
+        # Sections hold UTF-8 bytes, encoding every line as it comes keeps
+        # them at one byte per character and ready to write out as is
+        buf = self.sections.get(section)
+        if (buf is None):
+            buf = self.sections[section] = SectionBuffer()
+        data = buf.data
+        # Only the text needs encoding, the indentation is ready made
+        data += (
+            BYTE_TABS[indent] if indent < len(BYTE_TABS) else b"\t" * indent)
+        data += text.encode("utf-8")
+        data += b"\n"
+        if (len(data) > SECTION_SPILL_SIZE):
+            buf.spill()
+
+    def write_sections(self, f, end=None):
+        """Write out and free the sections before end, in document order."""
+        for x in sorted(self.sections):
+            if (end is not None and x >= end):
+                break
+            section = self.sections.pop(x)
+            section.write_to(f)
+            section.close()
 
     def purge_empty_nodes(self):
         sections = {}
         for k, v in self.sections.items():
-            if not (len(v) == 2 and v[0][1:] == v[1][2:]):
+            # An empty library is just its opening and closing tags, avoid
+            # splitting sections that are obviously larger
+            lines = ()
+            if (v.spool is None and len(v.data) < 256):
+                lines = v.data.splitlines()
+            if not (len(lines) == 2 and lines[0][1:] == lines[1][2:]):
                 sections[k] = v
         self.sections = sections
 
+    def is_file(self, path):
+        """os.path.isfile, remembered for the rest of the export."""
+        exists = self.files_known.get(path)
+        if (exists is None):
+            exists = os.path.isfile(path)
+            self.files_known[path] = exists
+        return exists
+
     def export_image(self, image):
         img_id = self.image_cache.get(image)
         if img_id:
@@ -173,18 +415,22 @@ class DaeExporter:
         imgpath = image.filepath
         if imgpath.startswith("//"):
             imgpath = bpy.path.abspath(imgpath)
-            print("exporting image path", imgpath)
         if (self.config["use_copy_images"]):
-            basedir = os.path.join(os.path.dirname(self.path), "images")
-            if (not os.path.isdir(basedir)):
-                os.makedirs(basedir)
-
-            if os.path.isfile(imgpath):
-                dstfile = os.path.join(basedir, os.path.basename(imgpath))
-
-                if not os.path.isfile(dstfile):
-                    shutil.copy(imgpath, dstfile)
-                imgpath = os.path.join("images", os.path.basename(imgpath))
+            basedir = os.path.join(self.output_dir, "images")
+            if (basedir not in self.dirs_created):
+                if (not os.path.isdir(basedir)):
+                    os.makedirs(basedir)
+                self.dirs_created.add(basedir)
+
+            if (imgpath in self.copied_images or self.is_file(imgpath)):
+                imgname = os.path.basename(imgpath)
+                if (imgpath not in self.copied_images):
+                    dstfile = os.path.join(basedir, imgname)
+                    if not self.is_file(dstfile):
+                        shutil.copy(imgpath, dstfile)
+                        self.files_known[dstfile] = True
+                    self.copied_images.add(imgpath)
+                imgpath = os.path.join("images", imgname)
             else:
                 img_tmp_path = image.filepath
                 if img_tmp_path.lower().endswith(
@@ -198,8 +444,9 @@ class DaeExporter:
                 dstfile = os.path.join(
                     basedir, os.path.basename(image.filepath))
 
-                if not os.path.isfile(dstfile):
+                if not self.is_file(dstfile):
                     image.save()
+                    self.files_known[dstfile] = True
                 imgpath = os.path.join(
                     "images", os.path.basename(image.filepath))
                 image.filepath = img_tmp_path
@@ -208,18 +455,17 @@ class DaeExporter:
         else:
             try:
                 imgpath = os.path.relpath(
-                    imgpath, os.path.dirname(self.path)).replace("\\", "/")
+                    imgpath, self.output_dir).replace("\\", "/")
             except:
                 # TODO: Review, not sure why it fails
                 pass
         
         imgid = self.new_id("image")
 
-        print("FOR: {}".format(imgpath))
-
         self.writel(S_IMGS, 1, "<image id=\"{}\" name=\"{}\">".format(
-            imgid, image.name))
-        self.writel(S_IMGS, 2, "<init_from>{}</init_from>".format(imgpath))
+            imgid, xmlattr(image.name)))
+        self.writel(S_IMGS, 2, "<init_from>{}</init_from>".format(
+            escape(imgpath)))
         self.writel(S_IMGS, 1, "</image>")
         self.image_cache[image] = imgid
         return imgid
@@ -231,7 +477,7 @@ class DaeExporter:
 
         fxid = self.new_id("fx")
         self.writel(S_FX, 1, "<effect id=\"{}\" name=\"{}-fx\">".format(
-            fxid, material.name))
+            fxid, xmlattr(material.name)))
         self.writel(S_FX, 2, "<profile_COMMON>")
 
         # Find and fetch the textures and create sources    
@@ -246,46 +492,35 @@ class DaeExporter:
         
         if mat_wrap:
             textures_keys = ["base_color_texture", "specular_texture", "normalmap_texture"]
-            
+            # Look every texture up once and keep only the image ones
+            textures = []
             for i, tkey in enumerate(textures_keys):
                 tex = getattr(mat_wrap, tkey, None)
-                if tex == None:
-                    continue
-                if tex.image == None:
+                if tex is None or tex.image is None:
                     continue
+                textures.append((i, tkey, tex))
+            texture_samplers = {}
 
+            for i, tkey, tex in textures:
                 # Image
                 imgid = self.export_image(tex.image)
                 
-                # Surface
                 surface_sid = self.new_id("fx_surf")
-                self.writel(S_FX, 3, "<newparam sid=\"{}\">".format(surface_sid))
-                self.writel(S_FX, 4, "<surface type=\"2D\">")
-                self.writel(S_FX, 5, "<init_from>{}</init_from>".format(imgid))
-                self.writel(S_FX, 5, "<format>A8R8G8B8</format>")
-                self.writel(S_FX, 4, "</surface>")
-                self.writel(S_FX, 3, "</newparam>")
-                
-                # Sampler
                 sampler_sid = self.new_id("fx_sampler")
-                self.writel(S_FX, 3, "<newparam sid=\"{}\">".format(sampler_sid))
-                self.writel(S_FX, 4, "<sampler2D>")
-                self.writel(S_FX, 5, "<source>{}</source>".format(surface_sid))
-                self.writel(S_FX, 4, "</sampler2D>")
-                self.writel(S_FX, 3, "</newparam>")
+                self.writel(S_FX, 0, EFFECT_SAMPLER.format(
+                    surface_sid=surface_sid, sampler_sid=sampler_sid,
+                    imgid=imgid))
                 sampler_table[i] = sampler_sid
-                
-                if tkey == "base_color_texture" and diffuse_tex is None:
-                    diffuse_tex = sampler_sid
-                if tkey == "specular_texture" and specular_tex is None:
-                    specular_tex = sampler_sid
-                """
-                # TODO differently, no emission input in the principled shader
-                if ts.use_map_emit and emission_tex is None:
-                    emission_tex = sampler_sid
-                """
-                if tkey == "normalmap_texture" and normal_tex is None:
-                    normal_tex = sampler_sid
+                texture_samplers[tkey] = sampler_sid
+
+            diffuse_tex = texture_samplers.get("base_color_texture")
+            specular_tex = texture_samplers.get("specular_texture")
+            """
+            # TODO differently, no emission input in the principled shader
+            if ts.use_map_emit and emission_tex is None:
+                emission_tex = sampler_sid
+            """
+            normal_tex = texture_samplers.get("normalmap_texture")
         
         """
         for i in range(len(material.texture_slots)):
@@ -333,111 +568,65 @@ class DaeExporter:
                 normal_tex = sampler_sid
         """
         
-        self.writel(S_FX, 3, "<technique sid=\"common\">")
-        shtype = "blinn"
-        self.writel(S_FX, 4, "<{}>".format(shtype))
-
-        self.writel(S_FX, 5, "<emission>")
-        if emission_tex is not None:
-            self.writel(
-                S_FX, 6, "<texture texture=\"{}\" texcoord=\"CHANNEL1\"/>"
-                .format(emission_tex))
-        else:
-            # TODO: More accurate coloring, if possible     
-            self.writel(S_FX, 6, "<color>{}</color>".format(
-                numarr_alpha(material.diffuse_color, 1.0)))#material.emit is removed in Blender 2.8             
-        self.writel(S_FX, 5, "</emission>")
-
-        self.writel(S_FX, 5, "<ambient>")
-        self.writel(S_FX, 6, "<color>{}</color>".format(
-            numarr_alpha((0.0,0.0,0.0), 1.0)))# self.scene.world.ambient_color and material.ambient are removed too
-        self.writel(S_FX, 5, "</ambient>")
-
-        self.writel(S_FX, 5, "<diffuse>")
-        if diffuse_tex is not None:
-            self.writel(
-                S_FX, 6, "<texture texture=\"{}\" texcoord=\"CHANNEL1\"/>"
-                .format(diffuse_tex))
+        if (emission_tex is not None):
+            emission = EFFECT_TEXTURE.format(emission_tex)
         else:
-            self.writel(S_FX, 6, "<color>{}</color>".format(numarr_alpha(
-                material.diffuse_color, 0.8)))# material.diffuse_intensity is removed too
-        self.writel(S_FX, 5, "</diffuse>")
+            # TODO: More accurate coloring, if possible
+            # material.emit is removed in Blender 2.8
+            emission = EFFECT_COLOR.format(
+                numarr_alpha(material.diffuse_color, 1.0))
 
-        self.writel(S_FX, 5, "<specular>")
-        if specular_tex is not None:
-            self.writel(
-                S_FX, 6,
-                "<texture texture=\"{}\" texcoord=\"CHANNEL1\"/>".format(
-                    specular_tex))
+        if (diffuse_tex is not None):
+            diffuse = EFFECT_TEXTURE.format(diffuse_tex)
         else:
-            self.writel(S_FX, 6, "<color>{}</color>".format(numarr_alpha(
-                material.specular_color, material.specular_intensity)))
-        self.writel(S_FX, 5, "</specular>")
-
-        self.writel(S_FX, 5, "<shininess>")
-        self.writel(S_FX, 6, "<float>{}</float>".format(
-            50))# material.specular_hardness is removed too
-        self.writel(S_FX, 5, "</shininess>")
-
-        self.writel(S_FX, 5, "<reflective>")
-        self.writel(S_FX, 6, "<color>{}</color>".format(
-            numarr_alpha((0.5,0.5,0.5))))# material.mirror_color is removed too
-        self.writel(S_FX, 5, "</reflective>")
-
-        """
-        #material.use_transparency is removed too
-        if (material.use_transparency):
-            self.writel(S_FX, 5, "<transparency>")
-            self.writel(S_FX, 6, "<float>{}</float>".format(material.alpha))
-            self.writel(S_FX, 5, "</transparency>")
-        """
-        
-        self.writel(S_FX, 5, "<index_of_refraction>")
-        self.writel(S_FX, 6, "<float>{}</float>".format(1.2))#material.specular_ior is removed too
-        self.writel(S_FX, 5, "</index_of_refraction>")
+            # material.diffuse_intensity is removed in Blender 2.8
+            diffuse = EFFECT_COLOR.format(
+                numarr_alpha(material.diffuse_color, 0.8))
 
-        self.writel(S_FX, 4, "</{}>".format(shtype))
-
-        self.writel(S_FX, 4, "<extra>")
-        self.writel(S_FX, 5, "<technique profile=\"FCOLLADA\">")
-        if (normal_tex):
-            self.writel(S_FX, 6, "<bump bumptype=\"NORMALMAP\">")
-            self.writel(
-                S_FX, 7,
-                "<texture texture=\"{}\" texcoord=\"CHANNEL1\"/>".format(
-                    normal_tex))
-            self.writel(S_FX, 6, "</bump>")
-
-        self.writel(S_FX, 5, "</technique>")
-        self.writel(S_FX, 5, "<technique profile=\"GOOGLEEARTH\">")
-        self.writel(S_FX, 6, "<double_sided>{}</double_sided>".format(
-            int(double_sided_hint)))
-        self.writel(S_FX, 5, "</technique>")
-    
-        """
-        if (material.use_shadeless):#material.use_shadeless is removed too
-            self.writel(S_FX, 5, "<technique profile=\"GODOT\">")
-            self.writel(S_FX, 6, "<unshaded>1</unshaded>")
-            self.writel(S_FX, 5, "</technique>")
-        """
-        self.writel(S_FX, 4, "</extra>")
+        if (specular_tex is not None):
+            specular = EFFECT_TEXTURE.format(specular_tex)
+        else:
+            specular = EFFECT_COLOR.format(numarr_alpha(
+                material.specular_color, material.specular_intensity))
 
-        self.writel(S_FX, 3, "</technique>")
-        self.writel(S_FX, 2, "</profile_COMMON>")
-        self.writel(S_FX, 1, "</effect>")
+        self.writel(S_FX, 0, EFFECT_TECHNIQUE.format(
+            emission=emission, diffuse=diffuse, specular=specular,
+            bump=EFFECT_BUMP.format(normal_tex) if normal_tex else "",
+            double_sided=int(double_sided_hint)))
 
         # Material (if active)
         matid = self.new_id("material")
         self.writel(S_MATS, 1, "<material id=\"{}\" name=\"{}\">".format(
-            matid, material.name))
+            matid, xmlattr(material.name)))
         self.writel(S_MATS, 2, "<instance_effect url=\"#{}\"/>".format(fxid))
         self.writel(S_MATS, 1, "</material>")
 
         self.material_cache[material] = matid
         return matid
 
+    def export_float_source(self, geomid, suffix, params, values):
+        """Write a float <source>, one accessor param per value column."""
+        count = len(values)
+        self.writel(S_GEOM, 3, "<source id=\"{}-{}\">".format(geomid, suffix))
+        self.writel(
+            S_GEOM, 4, "<float_array id=\"{}-{}-array\" "
+            "count=\"{}\">{}</float_array>".format(
+                geomid, suffix, count * len(params), floatarr(values)))
+        self.writel(S_GEOM, 4, "<technique_common>")
+        self.writel(
+            S_GEOM, 5, "<accessor source=\"#{}-{}-array\" "
+            "count=\"{}\" stride=\"{}\">".format(
+                geomid, suffix, count, len(params)))
+        for param in params:
+            self.writel(
+                S_GEOM, 6, "<param name=\"{}\" type=\"float\"/>".format(
+                    param))
+        self.writel(S_GEOM, 5, "</accessor>")
+        self.writel(S_GEOM, 4, "</technique_common>")
+        self.writel(S_GEOM, 3, "</source>")
+
     def export_mesh(self, node, armature=None, skeyindex=-1, skel_source=None,
-                    custom_name=None):
+                    custom_name=None, shape_positions=None):
         mesh = node.data
         
         if (node.data in self.mesh_cache):
@@ -455,8 +644,31 @@ class DaeExporter:
 
             mid = self.new_id("morph")
 
+            # When no modifier reshapes the mesh, each morph target is the
+            # base mesh with the key positions swapped in, so the object
+            # does not need to be evaluated once per key. Keys masked by a
+            # vertex group or muted only come out right when evaluated
+            bulk_shapes = mesh.shape_keys.use_relative and all(
+                m.type == "ARMATURE" and
+                self.config["use_exclude_armature_modifier"]
+                for m in node.modifiers) and not any(
+                    kb.vertex_group or kb.mute
+                    for kb in mesh.shape_keys.key_blocks)
+
             for k in range(0, len(mesh.shape_keys.key_blocks)):
                 shape = node.data.shape_keys.key_blocks[k]
+                if (bulk_shapes):
+                    co = np.empty(len(shape.data) * 3, dtype=np.float32)
+                    shape.data.foreach_get("co", co)
+                    if (armature and k == 0):
+                        md = self.export_mesh(
+                            node, armature, k, mid, shape.name, co)
+                    else:
+                        md = self.export_mesh(
+                            node, None, k, None, shape.name, co)
+                    morph_targets.append(md)
+                    continue
+
                 node.show_only_shape_key = True
                 node.active_shape_key_index = k
                 shape.value = 1.0
@@ -468,20 +680,20 @@ class DaeExporter:
                 
                 if(self.config["use_exclude_armature_modifier"]):
                     armature_modifiers = [i for i in node.modifiers if i.type == "ARMATURE"]
-                    armature_modifier = armature_modifiers[0]#node.modifiers.get("Armature")
+                    if len(armature_modifiers) > 0:
+                        armature_modifier = armature_modifiers[0]#node.modifiers.get("Armature")
 
                 if(armature_modifier):  
                     # the armature modifier must be disabled too
                     armature_modifier_state = armature_modifier.show_viewport
                     armature_modifier.show_viewport = False         
                 
-                print(node)
                 v = node.to_mesh(preserve_all_data_layers=True, depsgraph=bpy.context.evaluated_depsgraph_get()) 
-                print(v)
                 # Warning, Blender 2.8 does not support anymore the "RENDER" argument to apply modifier
                 # with render state only...
                 
-                armature_modifier.show_viewport = armature_modifier_state
+                if(armature_modifier):
+                    armature_modifier.show_viewport = armature_modifier_state
                 
                 self.temp_meshes.add(v)
                 deps = bpy.context.evaluated_depsgraph_get()
@@ -597,7 +809,6 @@ class DaeExporter:
         if(self.config["use_exclude_armature_modifier"]):
             armature_modifiers = [i for i in node.modifiers if i.type == "ARMATURE"]
             if len(armature_modifiers) > 0:
-                print(node.name)            
                 armature_modifier = armature_modifiers[0]#node.modifiers.get("Armature")
 
         # Set armature in rest pose
@@ -630,6 +841,10 @@ class DaeExporter:
 
 
         self.temp_meshes.add(mesh)
+        if (shape_positions is not None):
+            mesh.vertices.foreach_set("co", shape_positions)
+            mesh.update()
+
         triangulate = self.config["use_triangles"]
         if (triangulate):
             bm = bmesh.new()
@@ -637,17 +852,15 @@ class DaeExporter:
             bmesh.ops.triangulate(bm, faces=bm.faces)
             bm.to_mesh(mesh)
             bm.free()
+        else:
+            # bm.to_mesh() already leaves a triangulated mesh up to date
+            #mesh.update(calc_tessface=True)# 2.79
+            #mesh.update(calc_edges=False, calc_edges_loose=False, calc_loop_triangles=True)# 2.80
+            mesh.update(calc_edges=False, calc_edges_loose=False)# 3.0.1
 
-        #mesh.update(calc_tessface=True)# 2.79
-        #mesh.update(calc_edges=False, calc_edges_loose=False, calc_loop_triangles=True)# 2.80
-        mesh.update(calc_edges=False, calc_edges_loose=False)# 3.0.1
-        vertices = []
-        vertex_map = {}
         surface_indices = {}
         materials = {}
 
-        materials = {}
-
         si = None
         if armature is not None:
             si = self.skeleton_info[armature]
@@ -674,232 +887,218 @@ class DaeExporter:
             mesh.calc_normals_split()
             has_tangents = False
 
-        for fi in range(len(mesh.polygons)):
-            f = mesh.polygons[fi]
+        # Fetch vertex and loop attributes with bulk foreach_get copies
+        # instead of going through the RNA API once per loop
+        loop_count = len(mesh.loops)
+        positions = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", positions)
+        loop_vertex_indices = np.empty(loop_count, dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vertex_indices)
+        columns = [positions.reshape(-1, 3)[loop_vertex_indices]]
 
-            if not (f.material_index in surface_indices):
-                surface_indices[f.material_index] = []
+        loop_normals = np.empty(loop_count * 3, dtype=np.float32)
+        mesh.loops.foreach_get("normal", loop_normals)
+        columns.append(loop_normals.reshape(-1, 3))
 
-                try:
-                    # TODO: Review, understand why it throws
-                    mat = mesh.materials[f.material_index]
-                except:
-                    mat = None
-                
-                if (mat is not None):               
-                    materials[f.material_index] = self.export_material(
-                        mat, True)#True = deprecated mesh.show_double_sided value, which is removed from Blender 2.8
-                else:
-                    materials[f.material_index] = None
-
-            indices = surface_indices[f.material_index]
-            vi = []
-
-            for lt in range(f.loop_total):
-                loop_index = f.loop_start + lt
-                ml = mesh.loops[loop_index]
-                mv = mesh.vertices[ml.vertex_index]
-
-                v = self.Vertex()
-                v.vertex = Vector(mv.co)
-
-                for xt in mesh.uv_layers:
-                    v.uv.append(Vector(xt.data[loop_index].uv))
-
-                if (has_colors):
-                    v.color = Vector(
-                        mesh.vertex_colors[0].data[loop_index].color)
-
-                v.normal = Vector(ml.normal)
-
-                if (has_tangents):
-                    v.tangent = Vector(ml.tangent)
-                    v.bitangent = Vector(ml.bitangent)
-
-                if armature is not None:
-                    wsum = 0.0
-
-                    for vg in mv.groups:
-                        if vg.group >= len(node.vertex_groups):
-                            continue
-                        name = node.vertex_groups[vg.group].name
-
-                        if (name in si["bone_index"]):
-                            # TODO: Try using 0.0001 since Blender uses
-                            #       zero weight
-                            if (vg.weight > 0.001):
-                                v.bones.append(si["bone_index"][name])
-                                v.weights.append(vg.weight)
-                                wsum += vg.weight
-                    if (wsum == 0.0):
-                        if not self.wrongvtx_report:
-                            self.operator.report(
-                                {"WARNING"},
-                                "Mesh for object \"{}\" has unassigned "
-                                "weights. This may look wrong in exported "
-                                "model.".format(node.name))
-                            self.wrongvtx_report = True
-
-                        # TODO: Explore how to deal with zero-weight bones,
-                        #       which remain local
-                        v.bones.append(0)
-                        v.weights.append(1)
-
-                tup = v.get_tup()
-                idx = 0
-                # Do not optmize if using shapekeys
-                if (skeyindex == -1 and tup in vertex_map):
-                    idx = vertex_map[tup]
-                else:
-                    idx = len(vertices)
-                    vertices.append(v)
-                    vertex_map[tup] = idx
+        for xt in mesh.uv_layers:
+            uv = np.empty(loop_count * 2, dtype=np.float32)
+            xt.data.foreach_get("uv", uv)
+            columns.append(uv.reshape(-1, 2))
 
-                vi.append(idx)
+        if (has_colors):
+            # Vertex colors are RGBA, only RGB is exported
+            loop_colors = np.empty(loop_count * 4, dtype=np.float32)
+            mesh.vertex_colors[0].data.foreach_get("color", loop_colors)
+            columns.append(loop_colors.reshape(-1, 4)[:, :3])
 
-            if (len(vi) > 2):  # Only triangles and above
-                indices.append(vi)
+        if (has_tangents):
+            loop_tangents = np.empty(loop_count * 3, dtype=np.float32)
+            mesh.loops.foreach_get("tangent", loop_tangents)
+            columns.append(loop_tangents.reshape(-1, 3))
+            loop_bitangents = np.empty(loop_count * 3, dtype=np.float32)
+            mesh.loops.foreach_get("bitangent", loop_bitangents)
+            columns.append(loop_bitangents.reshape(-1, 3))
+
+        if armature is not None:
+            # Weights only depend on the vertex, so resolve them once per
+            # vertex and tag each distinct set of weights with an id that
+            # takes part in the deduplication key below
+            weight_sets = {}
+            vertex_weight_set = np.zeros(len(mesh.vertices), dtype=np.float64)
+            # Influences of all vertices are stored back to back, with the
+            # start and count of each vertex in separate arrays
+            influence_start = np.zeros(len(mesh.vertices), dtype=np.int64)
+            influence_count = np.zeros(len(mesh.vertices), dtype=np.int64)
+            influence_bones = []
+            influence_weights = []
+            verts = mesh.vertices
+            group_names = [vg.name for vg in node.vertex_groups]
+            group_count = len(group_names)
+            bone_index = si["bone_index"]
+            for vidx in np.unique(loop_vertex_indices).tolist():
+                bones = []
+                weights = []
+                wsum = 0.0
+
+                for vg in verts[vidx].groups:
+                    group = vg.group
+                    if group >= group_count:
+                        continue
+                    name = group_names[group]
+
+                    if (name in bone_index):
+                        # TODO: Try using 0.0001 since Blender uses
+                        #       zero weight
+                        weight = vg.weight
+                        if (weight > 0.001):
+                            bones.append(bone_index[name])
+                            weights.append(weight)
+                            wsum += weight
+                if (wsum == 0.0):
+                    if not self.wrongvtx_report:
+                        self.operator.report(
+                            {"WARNING"},
+                            "Mesh for object \"{}\" has unassigned "
+                            "weights. This may look wrong in exported "
+                            "model.".format(node.name))
+                        self.wrongvtx_report = True
+
+                    # TODO: Explore how to deal with zero-weight bones,
+                    #       which remain local
+                    bones.append(0)
+                    weights.append(1)
+
+                influence_start[vidx] = len(influence_bones)
+                influence_count[vidx] = len(bones)
+                influence_bones += bones
+                influence_weights += weights
+                vertex_weight_set[vidx] = weight_sets.setdefault(
+                    tuple(bones) + tuple(weights), len(weight_sets))
+            columns.append(vertex_weight_set[loop_vertex_indices, None])
+
+        # Loops in the order the polygons reference them
+        poly_count = len(mesh.polygons)
+        poly_loop_starts = np.empty(poly_count, dtype=np.int32)
+        mesh.polygons.foreach_get("loop_start", poly_loop_starts)
+        poly_loop_totals = np.empty(poly_count, dtype=np.int32)
+        mesh.polygons.foreach_get("loop_total", poly_loop_totals)
+        loop_order = np.arange(poly_loop_totals.sum()) + np.repeat(
+            poly_loop_starts - np.cumsum(poly_loop_totals) + poly_loop_totals,
+            poly_loop_totals)
+
+        rows = np.hstack(columns)[loop_order]
+        if (skeyindex == -1):
+            # Merge identical vertices, adding 0.0 folds -0.0 into 0.0 so
+            # both compare equal. np.unique sorts the rows, renumber them by
+            # first use to keep the output in polygon order.
+            _, first, inverse = np.unique(
+                rows + 0.0, axis=0, return_index=True, return_inverse=True)
+            order = np.argsort(first)
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            rows = rows[first[order]]
+            vertex_loops = loop_order[first[order]]
+            inverse = rank[inverse.reshape(-1)]
+
+            if (self.config["use_vertex_welding"]):
+                # Also merge vertices that only differ by float noise
+                vertex_hash = VertexHash(rows.shape[1])
+                welded = []
+                keep = []
+                for i, row in enumerate(rows.tolist()):
+                    idx = vertex_hash.insert(row)
+                    if (idx == len(keep)):
+                        keep.append(i)
+                    welded.append(idx)
+                rows = rows[keep]
+                vertex_loops = vertex_loops[keep]
+                inverse = np.array(welded, dtype=np.int64)[inverse]
+        else:
+            # Do not optmize if using shapekeys
+            vertex_loops = loop_order
+            inverse = np.arange(len(loop_order))
+
+        # Split the deduplicated rows back into one stream per attribute,
+        # which is how Collada sources expect them
+        vertex_count = len(rows)
+        vertex_positions = rows[:, 0:3]
+        vertex_normals = rows[:, 3:6]
+        col = 6
+        vertex_uvs = []
+        for uvi in range(uv_layer_count):
+            vertex_uvs.append(rows[:, col:col + 2])
+            col += 2
+        if (has_colors):
+            vertex_colors = rows[:, col:col + 3]
+            col += 3
+        if (has_tangents):
+            vertex_tangents = rows[:, col:col + 3]
+            vertex_bitangents = rows[:, col + 3:col + 6]
+        if armature is not None:
+            # Gather the influences of every exported vertex in one go
+            skin_vertices = loop_vertex_indices[vertex_loops]
+            skin_vcounts = influence_count[skin_vertices]
+            skin_weights_total = int(skin_vcounts.sum())
+            skin_gather = np.arange(skin_weights_total) + np.repeat(
+                influence_start[skin_vertices] - np.cumsum(skin_vcounts) +
+                skin_vcounts, skin_vcounts)
+            skin_bones = np.array(influence_bones, dtype=np.int64)[skin_gather]
+            skin_weights = np.array(
+                influence_weights, dtype=np.float32)[skin_gather]
+
+        # Group polygons by material with array masks rather than a
+        # Python loop over every polygon
+        poly_material_indices = np.empty(poly_count, dtype=np.int32)
+        mesh.polygons.foreach_get("material_index", poly_material_indices)
+        used_materials, first_use = np.unique(
+            poly_material_indices, return_index=True)
+        used_materials = used_materials[np.argsort(first_use)]
+        valid_polys = poly_loop_totals > 2  # Only triangles and above
+
+        mesh_materials = mesh.materials
+        for material_index in used_materials.tolist():
+            try:
+                # TODO: Review, understand why it throws
+                mat = mesh_materials[material_index]
+            except:
+                mat = None
+            
+            if (mat is not None):               
+                materials[material_index] = self.export_material(
+                    mat, True)#True = deprecated mesh.show_double_sided value, which is removed from Blender 2.8
+            else:
+                materials[material_index] = None
+
+            surface_polys = valid_polys & (
+                poly_material_indices == material_index)
+            surface_loops = inverse[np.repeat(surface_polys, poly_loop_totals)]
+            surface_indices[material_index] = (
+                surface_loops, poly_loop_totals[surface_polys])
 
         meshid = self.new_id("mesh")
         self.writel(
             S_GEOM, 1, "<geometry id=\"{}\" name=\"{}\">".format(
-                meshid, name_to_use))
+                meshid, xmlattr(name_to_use)))
 
         self.writel(S_GEOM, 2, "<mesh>")
 
-        # Vertex Array
-        self.writel(S_GEOM, 3, "<source id=\"{}-positions\">".format(meshid))
-        float_values = ""
-        for v in vertices:
-            float_values += " {} {} {}".format(
-                v.vertex.x, v.vertex.y, v.vertex.z)
-        self.writel(
-            S_GEOM, 4, "<float_array id=\"{}-positions-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                meshid, len(vertices) * 3, float_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 4, "<accessor source=\"#{}-positions-array\" "
-            "count=\"{}\" stride=\"3\">".format(meshid, len(vertices)))
-        self.writel(S_GEOM, 5, "<param name=\"X\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "<param name=\"Y\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "<param name=\"Z\" type=\"float\"/>")
-        self.writel(S_GEOM, 4, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
-
-        # Normals Array
-        self.writel(S_GEOM, 3, "<source id=\"{}-normals\">".format(meshid))
-        float_values = ""
-        for v in vertices:
-            float_values += " {} {} {}".format(
-                v.normal.x, v.normal.y, v.normal.z)
-        self.writel(
-            S_GEOM, 4, "<float_array id=\"{}-normals-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                meshid, len(vertices) * 3, float_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 4, "<accessor source=\"#{}-normals-array\" count=\"{}\" "
-            "stride=\"3\">".format(meshid, len(vertices)))
-        self.writel(S_GEOM, 5, "<param name=\"X\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "<param name=\"Y\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "<param name=\"Z\" type=\"float\"/>")
-        self.writel(S_GEOM, 4, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
+        self.export_float_source(meshid, "positions", "XYZ", vertex_positions)
+        self.export_float_source(meshid, "normals", "XYZ", vertex_normals)
 
         if (has_tangents):
-            self.writel(
-                S_GEOM, 3, "<source id=\"{}-tangents\">".format(meshid))
-            float_values = ""
-            for v in vertices:
-                float_values += " {} {} {}".format(
-                    v.tangent.x, v.tangent.y, v.tangent.z)
-            self.writel(
-                S_GEOM, 4, "<float_array id=\"{}-tangents-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    meshid, len(vertices) * 3, float_values))
-            self.writel(S_GEOM, 4, "<technique_common>")
-            self.writel(
-                S_GEOM, 4, "<accessor source=\"#{}-tangents-array\" "
-                "count=\"{}\" stride=\"3\">".format(meshid, len(vertices)))
-            self.writel(S_GEOM, 5, "<param name=\"X\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"Y\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"Z\" type=\"float\"/>")
-            self.writel(S_GEOM, 4, "</accessor>")
-            self.writel(S_GEOM, 4, "</technique_common>")
-            self.writel(S_GEOM, 3, "</source>")
-
-            self.writel(S_GEOM, 3, "<source id=\"{}-bitangents\">".format(
-                meshid))
-            float_values = ""
-            for v in vertices:
-                float_values += " {} {} {}".format(
-                    v.bitangent.x, v.bitangent.y, v.bitangent.z)
-            self.writel(
-                S_GEOM, 4, "<float_array id=\"{}-bitangents-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    meshid, len(vertices) * 3, float_values))
-            self.writel(S_GEOM, 4, "<technique_common>")
-            self.writel(
-                S_GEOM, 4, "<accessor source=\"#{}-bitangents-array\" "
-                "count=\"{}\" stride=\"3\">".format(meshid, len(vertices)))
-            self.writel(S_GEOM, 5, "<param name=\"X\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"Y\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"Z\" type=\"float\"/>")
-            self.writel(S_GEOM, 4, "</accessor>")
-            self.writel(S_GEOM, 4, "</technique_common>")
-            self.writel(S_GEOM, 3, "</source>")
+            self.export_float_source(
+                meshid, "tangents", "XYZ", vertex_tangents)
+            self.export_float_source(
+                meshid, "bitangents", "XYZ", vertex_bitangents)
 
         # UV Arrays
         for uvi in range(uv_layer_count):
-            self.writel(S_GEOM, 3, "<source id=\"{}-texcoord-{}\">".format(
-                meshid, uvi))
-            float_values = ""
-            for v in vertices:
-                try:
-                    float_values += " {} {}".format(v.uv[uvi].x, v.uv[uvi].y)
-                except:
-                    # TODO: Review, understand better the multi-uv-layer API
-                    float_values += " 0 0 "
-
-            self.writel(
-                S_GEOM, 4, "<float_array id=\"{}-texcoord-{}-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    meshid, uvi, len(vertices) * 2, float_values))
-            self.writel(S_GEOM, 4, "<technique_common>")
-            self.writel(
-                S_GEOM, 4, "<accessor source=\"#{}-texcoord-{}-array\" "
-                "count=\"{}\" stride=\"2\">".format(
-                    meshid, uvi, len(vertices)))
-            self.writel(S_GEOM, 5, "<param name=\"S\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"T\" type=\"float\"/>")
-            self.writel(S_GEOM, 4, "</accessor>")
-            self.writel(S_GEOM, 4, "</technique_common>")
-            self.writel(S_GEOM, 3, "</source>")
+            self.export_float_source(
+                meshid, "texcoord-{}".format(uvi), "ST", vertex_uvs[uvi])
 
         # Color Arrays
         if (has_colors):
-            self.writel(S_GEOM, 3, "<source id=\"{}-colors\">".format(meshid))
-            float_values = ""
-            for v in vertices:
-                float_values += " {} {} {}".format(
-                    v.color.x, v.color.y, v.color.z)
-            self.writel(
-                S_GEOM, 4, "<float_array id=\"{}-colors-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    meshid, len(vertices) * 3, float_values))
-            self.writel(S_GEOM, 4, "<technique_common>")
-            self.writel(
-                S_GEOM, 4, "<accessor source=\"#{}-colors-array\" "
-                "count=\"{}\" stride=\"3\">".format(meshid, len(vertices)))
-            self.writel(S_GEOM, 5, "<param name=\"X\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"Y\" type=\"float\"/>")
-            self.writel(S_GEOM, 5, "<param name=\"Z\" type=\"float\"/>")
-            self.writel(S_GEOM, 4, "</accessor>")
-            self.writel(S_GEOM, 4, "</technique_common>")
-            self.writel(S_GEOM, 3, "</source>")
+            self.export_float_source(meshid, "colors", "XYZ", vertex_colors)
 
         # Triangle Lists
         self.writel(S_GEOM, 3, "<vertices id=\"{}-vertices\">".format(meshid))
@@ -915,8 +1114,31 @@ class DaeExporter:
         else:
             prim_type = "polygons"
 
+        # Every surface reads the same sources, build their inputs once
+        surface_inputs = [
+            "<input semantic=\"VERTEX\" source=\"#{}-vertices\" "
+            "offset=\"0\"/>".format(meshid),
+            "<input semantic=\"NORMAL\" source=\"#{}-normals\" "
+            "offset=\"0\"/>".format(meshid)]
+        for uvi in range(uv_layer_count):
+            surface_inputs.append(
+                "<input semantic=\"TEXCOORD\" source=\"#{}-texcoord-{}\" "
+                "offset=\"0\" set=\"{}\"/>".format(meshid, uvi, uvi))
+        if (has_colors):
+            surface_inputs.append(
+                "<input semantic=\"COLOR\" source=\"#{}-colors\" "
+                "offset=\"0\"/>".format(meshid))
+        if (has_tangents):
+            surface_inputs.append(
+                "<input semantic=\"TEXTANGENT\" source=\"#{}-tangents\" "
+                "offset=\"0\"/>".format(meshid))
+            surface_inputs.append(
+                "<input semantic=\"TEXBINORMAL\" "
+                "source=\"#{}-bitangents\" offset=\"0\"/>".format(meshid))
+        surface_inputs = indented((4, x) for x in surface_inputs)
+
         for m in surface_indices:
-            indices = surface_indices[m]
+            indices, poly_sizes = surface_indices[m]
             mat = materials[m]
 
             if (mat is not None):
@@ -924,51 +1146,25 @@ class DaeExporter:
                 self.writel(
                     S_GEOM, 3, "<{} count=\"{}\" material=\"{}\">".format(
                         prim_type,
-                        int(len(indices)), matref))  # TODO: Implement material
+                        len(poly_sizes), matref))  # TODO: Implement material
                 mat_assign.append((mat, matref))
             else:
                 self.writel(S_GEOM, 3, "<{} count=\"{}\">".format(
-                    prim_type, int(len(indices))))  # TODO: Implement material
-
-            self.writel(
-                S_GEOM, 4, "<input semantic=\"VERTEX\" "
-                "source=\"#{}-vertices\" offset=\"0\"/>".format(meshid))
-            self.writel(
-                S_GEOM, 4, "<input semantic=\"NORMAL\" "
-                "source=\"#{}-normals\" offset=\"0\"/>".format(meshid))
-
-            for uvi in range(uv_layer_count):
-                self.writel(
-                    S_GEOM, 4,
-                    "<input semantic=\"TEXCOORD\" source=\"#{}-texcoord-{}\" "
-                    "offset=\"0\" set=\"{}\"/>".format(meshid, uvi, uvi))
+                    prim_type, len(poly_sizes)))  # TODO: Implement material
 
-            if (has_colors):
-                self.writel(
-                    S_GEOM, 4, "<input semantic=\"COLOR\" "
-                    "source=\"#{}-colors\" offset=\"0\"/>".format(meshid))
-            if (has_tangents):
-                self.writel(
-                    S_GEOM, 4, "<input semantic=\"TEXTANGENT\" "
-                    "source=\"#{}-tangents\" offset=\"0\"/>".format(meshid))
-                self.writel(
-                    S_GEOM, 4, "<input semantic=\"TEXBINORMAL\" "
-                    "source=\"#{}-bitangents\" offset=\"0\"/>".format(meshid))
+            self.writel(S_GEOM, 0, surface_inputs)
 
             if (triangulate):
-                int_values = "<p>"
-                for p in indices:
-                    for i in p:
-                        int_values += " {}".format(i)
-                int_values += " </p>"
-                self.writel(S_GEOM, 4, int_values)
+                self.writel(S_GEOM, 4, "<p> {} </p>".format(intarr(indices)))
             else:
-                for p in indices:
-                    int_values = "<p>"
-                    for i in p:
-                        int_values += " {}".format(i)
-                    int_values += " </p>"
-                    self.writel(S_GEOM, 4, int_values)
+                # This runs once per polygon, keep the lookups local
+                writel = self.writel
+                int_values = intarr(indices).split(" ")
+                start = 0
+                for size in poly_sizes.tolist():
+                    p = int_values[start:start + size]
+                    writel(S_GEOM, 4, f"<p> {' '.join(p)} </p>")
+                    start += size
 
             self.writel(S_GEOM, 3, "</{}>".format(prim_type))
 
@@ -998,9 +1194,7 @@ class DaeExporter:
                     strmtx(node.matrix_world)))
             # Joint Names
             self.writel(S_SKIN, 3, "<source id=\"{}-joints\">".format(contid))
-            name_values = ""
-            for v in si["bone_names"]:
-                name_values += " {}".format(v)
+            name_values = "".join(" " + v for v in si["bone_names"])
 
             self.writel(
                 S_SKIN, 4, "<Name_array id=\"{}-joints-array\" "
@@ -1018,9 +1212,13 @@ class DaeExporter:
             # Pose Matrices!
             self.writel(S_SKIN, 3, "<source id=\"{}-bind_poses\">".format(
                 contid))
-            pose_values = ""
-            for v in si["bone_bind_poses"]:
-                pose_values += " {}".format(strmtx(v))
+            # Every mesh skinned to the armature shares its bind poses,
+            # format them for the first one only
+            pose_values = si["bone_bind_poses_values"]
+            if (pose_values is None):
+                pose_values = " " + floatarr(np.array(
+                    si["bone_bind_poses"], dtype=np.float32))
+                si["bone_bind_poses_values"] = pose_values
 
             self.writel(
                 S_SKIN, 4, "<float_array id=\"{}-bind_poses-array\" "
@@ -1039,17 +1237,12 @@ class DaeExporter:
             # Skin Weights!
             self.writel(S_SKIN, 3, "<source id=\"{}-skin_weights\">".format(
                 contid))
-            skin_weights = ""
-            skin_weights_total = 0
-            for v in vertices:
-                skin_weights_total += len(v.weights)
-                for w in v.weights:
-                    skin_weights += " {}".format(w)
+            weight_values = " " + floatarr(skin_weights)
 
             self.writel(
                 S_SKIN, 4, "<float_array id=\"{}-skin_weights-array\" "
                 "count=\"{}\">{}</float_array>".format(
-                    contid, skin_weights_total, skin_weights))
+                    contid, skin_weights_total, weight_values))
             self.writel(S_SKIN, 4, "<technique_common>")
             self.writel(
                 S_SKIN, 4, "<accessor source=\"#{}-skin_weights-array\" "
@@ -1071,21 +1264,19 @@ class DaeExporter:
             self.writel(S_SKIN, 3, "</joints>")
             self.writel(
                 S_SKIN, 3, "<vertex_weights count=\"{}\">".format(
-                    len(vertices)))
+                    vertex_count))
             self.writel(
                 S_SKIN, 4, "<input semantic=\"JOINT\" "
                 "source=\"#{}-joints\" offset=\"0\"/>".format(contid))
             self.writel(
                 S_SKIN, 4, "<input semantic=\"WEIGHT\" "
                 "source=\"#{}-skin_weights\" offset=\"1\"/>".format(contid))
-            vcounts = ""
-            vs = ""
-            vcount = 0
-            for v in vertices:
-                vcounts += " {}".format(len(v.weights))
-                for b in v.bones:
-                    vs += " {} {}".format(b, vcount)
-                    vcount += 1
+            vcounts = " " + intarr(skin_vcounts)
+            # Each weight is only used once, so its index is just a counter
+            vs = np.stack(
+                (skin_bones, np.arange(skin_weights_total)),
+                axis=1)
+            vs = " " + intarr(vs)
             self.writel(S_SKIN, 4, "<vcount>{}</vcount>".format(vcounts))
             self.writel(S_SKIN, 4, "<v>{}</v>".format(vs))
             self.writel(S_SKIN, 3, "</vertex_weights>")
@@ -1178,59 +1369,71 @@ class DaeExporter:
             self.writel(S_NODES, il, "</instance_geometry>")
 
     def export_armature_bone(self, bone, il, si):
-        is_ctrl_bone = (
-            self.config["use_exclude_ctrl_bones"] and
-            (bone.name.startswith("ctrl") or bone.use_deform == False))
-        if (bone.parent is None and is_ctrl_bone is True):
-            self.operator.report(
-                {"WARNING"}, "Root bone cannot be a control bone:"+bone.name)
-            is_ctrl_bone = False
-
-        if (is_ctrl_bone is False):
-            boneid = self.new_id("bone")
-            boneidx = si["bone_count"]
-            si["bone_count"] += 1
-            bonesid = "{}-{}".format(si["id"], boneidx)
-            if (bone.name in self.used_bones):
-                if (self.config["use_anim_action_all"]):
-                    self.operator.report(
-                        {"WARNING"}, "Bone name \"{}\" used in more than one "
-                        "skeleton. Actions might export wrong.".format(
-                            bone.name))
-            else:
-                self.used_bones.append(bone.name)
-
-            si["bone_index"][bone.name] = boneidx
-            si["bone_ids"][bone] = boneid
-            si["bone_names"].append(bonesid)
-            self.writel(
-                S_NODES, il, "<node id=\"{}\" sid=\"{}\" name=\"{}\" "
-                "type=\"JOINT\">".format(boneid, bonesid, bone.name))
-
-        if (is_ctrl_bone is False):
-            il += 1
+        # Walk the bones depth first with an explicit stack, entries with
+        # closing set write the </node> of a bone once its children are done
+        stack = [(bone, il, False)]
+        while stack:
+            bone, il, closing = stack.pop()
+            if (closing):
+                self.writel(S_NODES, il, "</node>")
+                continue
 
-        xform = bone.matrix_local
-        if (is_ctrl_bone is False):
-            si["bone_bind_poses"].append(
-                    (si["armature_xform"] @ xform).inverted_safe())
+            is_ctrl_bone = (
+                self.config["use_exclude_ctrl_bones"] and
+                (bone.name.startswith("ctrl") or bone.use_deform == False))
+            if (bone.parent is None and is_ctrl_bone is True):
+                self.operator.report(
+                    {"WARNING"},
+                    "Root bone cannot be a control bone:"+bone.name)
+                is_ctrl_bone = False
+
+            if (is_ctrl_bone is False):
+                boneid = self.new_id("bone")
+                boneidx = si["bone_count"]
+                si["bone_count"] += 1
+                bonesid = "{}-{}".format(si["id"], boneidx)
+                if (bone.name in self.used_bones):
+                    if (self.config["use_anim_action_all"]):
+                        self.operator.report(
+                            {"WARNING"}, "Bone name \"{}\" used in more "
+                            "than one skeleton. Actions might export "
+                            "wrong.".format(bone.name))
+                else:
+                    self.used_bones.add(bone.name)
 
-        if (bone.parent is not None):
-            xform = bone.parent.matrix_local.inverted_safe() @ xform
-        else:
-            si["skeleton_nodes"].append(boneid)
+                si["bone_index"][bone.name] = boneidx
+                si["bone_ids"][bone] = boneid
+                si["bone_names"].append(bonesid)
+                self.writel(
+                    S_NODES, il, "<node id=\"{}\" sid=\"{}\" name=\"{}\" "
+                    "type=\"JOINT\">".format(
+                        boneid, bonesid, xmlattr(bone.name)))
+                stack.append((bone, il, True))
+                il += 1
+
+            xform = bone.matrix_local
+            if (is_ctrl_bone is False):
+                if (si["bone_bind_inverses"] is not None):
+                    si["bone_bind_poses"].append(
+                        si["bone_bind_inverses"][bone.name])
+                else:
+                    si["bone_bind_poses"].append(
+                        (si["armature_xform"] @ xform).inverted_safe())
 
-        if (is_ctrl_bone is False):
-            self.writel(
-                S_NODES, il, "<matrix sid=\"transform\">{}</matrix>".format(
-                    strmtx(xform)))
+            if (bone.parent is not None):
+                xform = bone.parent.matrix_local.inverted_safe() @ xform
+            else:
+                si["skeleton_nodes"].append(boneid)
 
-        for c in bone.children:
-            self.export_armature_bone(c, il, si)
+            if (is_ctrl_bone is False):
+                self.writel(
+                    S_NODES, il,
+                    "<matrix sid=\"transform\">{}</matrix>".format(
+                        strmtx(xform)))
 
-        if (is_ctrl_bone is False):
-            il -= 1
-            self.writel(S_NODES, il, "</node>")
+            # Pushed in reverse so they pop in their original order
+            for c in reversed(list(bone.children)):
+                stack.append((c, il, False))
 
     def export_armature_node(self, node, il):
         if (node.data is None):
@@ -1239,6 +1442,36 @@ class DaeExporter:
         self.skeletons.append(node)
 
         armature = node.data
+
+        # Invert the bind poses of all bones in one go. A singular matrix
+        # makes the whole batch fail, then each bone falls back to
+        # inverted_safe() like before
+        bone_matrices = np.array(
+            [b.matrix_local for b in armature.bones],
+            dtype=np.float64).reshape(-1, 4, 4)
+        try:
+            bind_inverses = dict(zip(
+                [b.name for b in armature.bones],
+                np.linalg.inv(np.array(node.matrix_world) @ bone_matrices)))
+        except np.linalg.LinAlgError:
+            bind_inverses = None
+
+        # The bone each bone is animated relative to, skipping over control
+        # bones when they are excluded. A control bone resolved earlier
+        # already holds the rest of the walk
+        bone_parents = {}
+        for b in armature.bones:
+            parent = b.parent
+            if (parent is not None and
+                    self.config["use_exclude_ctrl_bones"]):
+                while ((parent.name.startswith("ctrl") or
+                        parent.use_deform == False) and parent.parent):
+                    if (parent.name in bone_parents):
+                        parent = bone_parents[parent.name]
+                        break
+                    parent = parent.parent
+            bone_parents[b.name] = parent
+
         self.skeleton_info[node] = {
             "bone_count": 0,
             "id": self.new_id("skelbones"),
@@ -1247,8 +1480,11 @@ class DaeExporter:
             "bone_ids": {},
             "bone_names": [],
             "bone_bind_poses": [],
+            "bone_bind_poses_values": None,
             "skeleton_nodes": [],
-            "armature_xform": node.matrix_world
+            "armature_xform": node.matrix_world,
+            "bone_bind_inverses": bind_inverses,
+            "bone_parents": bone_parents
         }
 
         for b in armature.bones:
@@ -1269,7 +1505,7 @@ class DaeExporter:
         camera = node.data
         camid = self.new_id("camera")
         self.writel(S_CAMS, 1, "<camera id=\"{}\" name=\"{}\">".format(
-            camid, camera.name))
+            camid, xmlattr(camera.name)))
         self.writel(S_CAMS, 2, "<optics>")
         self.writel(S_CAMS, 3, "<technique_common>")
         if (camera.type == "PERSP"):
@@ -1277,8 +1513,7 @@ class DaeExporter:
             self.writel(S_CAMS, 5, "<yfov>{}</yfov>".format(
                     math.degrees(camera.angle)))  # TODO: Review
             self.writel(S_CAMS, 5, "<aspect_ratio>{}</aspect_ratio>".format(
-                self.scene.render.resolution_x /
-                self.scene.render.resolution_y))
+                self.aspect_ratio))
             self.writel(S_CAMS, 5, "<znear>{}</znear>".format(
                 camera.clip_start))
             self.writel(S_CAMS, 5, "<zfar>{}</zfar>".format(camera.clip_end))
@@ -1288,8 +1523,7 @@ class DaeExporter:
             self.writel(S_CAMS, 5, "<xmag>{}</xmag>".format(
                 camera.ortho_scale * 0.5))  # TODO: Review
             self.writel(S_CAMS, 5, "<aspect_ratio>{}</aspect_ratio>".format(
-                self.scene.render.resolution_x /
-                self.scene.render.resolution_y))
+                self.aspect_ratio))
             self.writel(S_CAMS, 5, "<znear>{}</znear>".format(
                 camera.clip_start))
             self.writel(S_CAMS, 5, "<zfar>{}</zfar>".format(camera.clip_end))
@@ -1309,15 +1543,17 @@ class DaeExporter:
         light = node.data
         lightid = self.new_id("light")
         self.writel(S_LAMPS, 1, "<light id=\"{}\" name=\"{}\">".format(
-                lightid, light.name))
+                lightid, xmlattr(light.name)))
         self.writel(S_LAMPS, 3, "<technique_common>")
 
-        if (light.type == "POINT"):
-            self.writel(S_LAMPS, 4, "<point>")
-            self.writel(S_LAMPS, 5, "<color>{}</color>".format(
-                strarr(light.color)))
+        color = strarr(light.color)
+        if (light.type in ("POINT", "SPOT")):
             # Convert to linear attenuation
             att_by_distance = 2.0 / light.distance
+
+        if (light.type == "POINT"):
+            self.writel(S_LAMPS, 4, "<point>")
+            self.writel(S_LAMPS, 5, "<color>{}</color>".format(color))
             self.writel(
                 S_LAMPS, 5,
                 "<linear_attenuation>{}</linear_attenuation>".format(
@@ -1329,10 +1565,7 @@ class DaeExporter:
             self.writel(S_LAMPS, 4, "</point>")
         elif (light.type == "SPOT"):
             self.writel(S_LAMPS, 4, "<spot>")
-            self.writel(S_LAMPS, 5, "<color>{}</color>".format(
-                strarr(light.color)))
-            # Convert to linear attenuation
-            att_by_distance = 2.0 / light.distance
+            self.writel(S_LAMPS, 5, "<color>{}</color>".format(color))
             self.writel(
                 S_LAMPS, 5,
                 "<linear_attenuation>{}</linear_attenuation>".format(
@@ -1344,8 +1577,7 @@ class DaeExporter:
 
         else:  # Write a sun lamp for everything else (not supported)
             self.writel(S_LAMPS, 4, "<directional>")
-            self.writel(S_LAMPS, 5, "<color>{}</color>".format(
-                strarr(light.color)))
+            self.writel(S_LAMPS, 5, "<color>{}</color>".format(color))
             self.writel(S_LAMPS, 4, "</directional>")
 
         self.writel(S_LAMPS, 3, "</technique_common>")
@@ -1369,117 +1601,67 @@ class DaeExporter:
 
         self.writel(
             S_GEOM, 1, "<geometry id=\"{}\" name=\"{}\">".format(
-                splineid, curve.name))
+                splineid, xmlattr(curve.name)))
         self.writel(S_GEOM, 2, "<spline closed=\"{}\">".format(
                 "true" if curve.splines and curve.splines[0].use_cyclic_u else "false"))
 
-        points = []
+        # Read whole point attributes with foreach_get, an empty array at
+        # the front keeps np.concatenate happy for curves without splines
+        points = [np.empty(0, dtype=np.float32)]
         interps = []
-        handles_in = []
-        handles_out = []
-        tilts = []
+        handles_in = [points[0]]
+        handles_out = [points[0]]
+        tilts = [points[0]]
 
         for cs in curve.splines:
 
             if (cs.type == "BEZIER"):
-                for s in cs.bezier_points:
-                    points.append(s.co[0])
-                    points.append(s.co[1])
-                    points.append(s.co[2])
-
-                    handles_in.append(s.handle_left[0])
-                    handles_in.append(s.handle_left[1])
-                    handles_in.append(s.handle_left[2])
-
-                    handles_out.append(s.handle_right[0])
-                    handles_out.append(s.handle_right[1])
-                    handles_out.append(s.handle_right[2])
-
-                    tilts.append(s.tilt)
-                    interps.append("BEZIER")
+                count = len(cs.bezier_points)
+                co = np.empty(count * 3, dtype=np.float32)
+                cs.bezier_points.foreach_get("co", co)
+                handle_left = np.empty(count * 3, dtype=np.float32)
+                cs.bezier_points.foreach_get("handle_left", handle_left)
+                handle_right = np.empty(count * 3, dtype=np.float32)
+                cs.bezier_points.foreach_get("handle_right", handle_right)
+                tilt = np.empty(count, dtype=np.float32)
+                cs.bezier_points.foreach_get("tilt", tilt)
+                interp = "BEZIER"
             else:
-
-                for s in cs.points:
-                    points.append(s.co[0])
-                    points.append(s.co[1])
-                    points.append(s.co[2])
-                    handles_in.append(s.co[0])
-                    handles_in.append(s.co[1])
-                    handles_in.append(s.co[2])
-                    handles_out.append(s.co[0])
-                    handles_out.append(s.co[1])
-                    handles_out.append(s.co[2])
-                    tilts.append(s.tilt)
-                    interps.append("LINEAR")
-
-        self.writel(S_GEOM, 3, "<source id=\"{}-positions\">".format(splineid))
-        position_values = ""
-        for x in points:
-            position_values += " {}".format(x)
-        self.writel(
-            S_GEOM, 4, "<float_array id=\"{}-positions-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                splineid, len(points), position_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 5, "<accessor source=\"#{}-positions-array\" "
-            "count=\"{}\" stride=\"3\">".format(splineid, len(points) / 3))
-        self.writel(S_GEOM, 6, "<param name=\"X\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Y\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Z\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
-
-        self.writel(
-            S_GEOM, 3, "<source id=\"{}-intangents\">".format(splineid))
-        intangent_values = ""
-        for x in handles_in:
-            intangent_values += " {}".format(x)
-        self.writel(
-            S_GEOM, 4, "<float_array id=\"{}-intangents-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                splineid, len(points), intangent_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 5, "<accessor source=\"#{}-intangents-array\" "
-            "count=\"{}\" stride=\"3\">".format(splineid, len(points) / 3))
-        self.writel(S_GEOM, 6, "<param name=\"X\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Y\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Z\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
-
-        self.writel(S_GEOM, 3, "<source id=\"{}-outtangents\">".format(
-            splineid))
-        outtangent_values = ""
-        for x in handles_out:
-            outtangent_values += " {}".format(x)
-        self.writel(
-            S_GEOM, 4, "<float_array id=\"{}-outtangents-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                splineid, len(points), outtangent_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 5, "<accessor source=\"#{}-outtangents-array\" "
-            "count=\"{}\" stride=\"3\">".format(splineid, len(points) / 3))
-        self.writel(S_GEOM, 6, "<param name=\"X\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Y\" type=\"float\"/>")
-        self.writel(S_GEOM, 6, "<param name=\"Z\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
+                # Spline points are 4D, the handles are just the points
+                count = len(cs.points)
+                co = np.empty(count * 4, dtype=np.float32)
+                cs.points.foreach_get("co", co)
+                co = co.reshape(count, 4)[:, :3].ravel()
+                handle_left = co
+                handle_right = co
+                tilt = np.empty(count, dtype=np.float32)
+                cs.points.foreach_get("tilt", tilt)
+                interp = "LINEAR"
+
+            points.append(co)
+            handles_in.append(handle_left)
+            handles_out.append(handle_right)
+            tilts.append(tilt)
+            interps += [interp] * count
+
+        points = np.concatenate(points)
+        handles_in = np.concatenate(handles_in)
+        handles_out = np.concatenate(handles_out)
+        tilts = np.concatenate(tilts)
+
+        self.export_float_source(
+            splineid, "positions", "XYZ", points.reshape(-1, 3))
+        self.export_float_source(
+            splineid, "intangents", "XYZ", handles_in.reshape(-1, 3))
+        self.export_float_source(
+            splineid, "outtangents", "XYZ", handles_out.reshape(-1, 3))
 
         self.writel(
             S_GEOM, 3, "<source id=\"{}-interpolations\">".format(splineid))
-        interpolation_values = ""
-        for x in interps:
-            interpolation_values += " {}".format(x)
         self.writel(
             S_GEOM, 4, "<Name_array id=\"{}-interpolations-array\" "
-            "count=\"{}\">{}</Name_array>"
-            .format(splineid, len(interps), interpolation_values))
+            "count=\"{}\"> {}</Name_array>"
+            .format(splineid, len(interps), " ".join(interps)))
         self.writel(S_GEOM, 4, "<technique_common>")
         self.writel(
             S_GEOM, 5, "<accessor source=\"#{}-interpolations-array\" "
@@ -1489,22 +1671,7 @@ class DaeExporter:
         self.writel(S_GEOM, 4, "</technique_common>")
         self.writel(S_GEOM, 3, "</source>")
 
-        self.writel(S_GEOM, 3, "<source id=\"{}-tilts\">".format(splineid))
-        tilt_values = ""
-        for x in tilts:
-            tilt_values += " {}".format(x)
-        self.writel(
-            S_GEOM, 4,
-            "<float_array id=\"{}-tilts-array\" count=\"{}\">{}</float_array>"
-            .format(splineid, len(tilts), tilt_values))
-        self.writel(S_GEOM, 4, "<technique_common>")
-        self.writel(
-            S_GEOM, 5, "<accessor source=\"#{}-tilts-array\" "
-            "count=\"{}\" stride=\"1\">".format(splineid, len(tilts)))
-        self.writel(S_GEOM, 6, "<param name=\"TILT\" type=\"float\"/>")
-        self.writel(S_GEOM, 5, "</accessor>")
-        self.writel(S_GEOM, 4, "</technique_common>")
-        self.writel(S_GEOM, 3, "</source>")
+        self.export_float_source(splineid, "tilts", ("TILT",), tilts)
 
         self.writel(S_GEOM, 3, "<control_vertices>")
         self.writel(
@@ -1541,61 +1708,63 @@ class DaeExporter:
             curveid))
         self.writel(S_NODES, il, "</instance_geometry>")
 
-    def export_node(self, node, il):        
-        if (node not in self.valid_nodes):
-            return
+    def export_node(self, node, il):
+        # Same explicit stack walk as export_armature_bone
+        stack = [(node, il, False)]
+        while stack:
+            node, il, closing = stack.pop()
+            if (closing):
+                self.writel(S_NODES, il, "</node>")
+                continue
 
-        prev_node = bpy.context.view_layer.objects.active
-        bpy.context.view_layer.objects.active = node
+            if (node not in self.valid_nodes):
+                continue
 
-        self.writel(
-            S_NODES, il, "<node id=\"{}\" name=\"{}\" type=\"NODE\">".format(
-                self.validate_id(node.name), node.name))
-        il += 1
+            self.writel(
+                S_NODES, il,
+                "<node id=\"{}\" name=\"{}\" type=\"NODE\">".format(
+                    self.validate_id(node.name), xmlattr(node.name)))
+            stack.append((node, il, True))
+            il += 1
 
-        self.writel(
-            S_NODES, il, "<matrix sid=\"transform\">{}</matrix>".format(
-                strmtx(node.matrix_local)))
-        if (node.type == "MESH"):
-            self.export_mesh_node(node, il)
-        elif (node.type == "CURVE"):
-            self.export_curve_node(node, il)
-        elif (node.type == "ARMATURE"):
-            self.export_armature_node(node, il)
-        elif (node.type == "CAMERA"):
-            self.export_camera_node(node, il)
-        elif (node.type == "LAMP"):
-            self.export_lamp_node(node, il)
-        elif (node.type == "EMPTY"):
-            self.export_empty_node(node, il)
-
-        for x in sorted(node.children, key=lambda x: x.name):
-            self.export_node(x, il)
-
-        il -= 1
-        self.writel(S_NODES, il, "</node>")
-        bpy.context.view_layer.objects.active = prev_node
+            self.writel(
+                S_NODES, il, "<matrix sid=\"transform\">{}</matrix>".format(
+                    strmtx(node.matrix_local)))
+            if (node.type == "MESH"):
+                # Only mesh evaluation cares about the active object, other
+                # node types skip the RNA round trips of swapping it
+                prev_node = bpy.context.view_layer.objects.active
+                bpy.context.view_layer.objects.active = node
+                self.export_mesh_node(node, il)
+                bpy.context.view_layer.objects.active = prev_node
+            elif (node.type == "CURVE"):
+                self.export_curve_node(node, il)
+            elif (node.type == "ARMATURE"):
+                self.export_armature_node(node, il)
+            elif (node.type == "CAMERA"):
+                self.export_camera_node(node, il)
+            elif (node.type == "LAMP"):
+                self.export_lamp_node(node, il)
+            elif (node.type == "EMPTY"):
+                self.export_empty_node(node, il)
+
+            for x in reversed(self.node_children.get(node, ())):
+                stack.append((x, il, False))
 
     def is_node_valid(self, node):
         if (node.type not in self.config["object_types"]):
             return False
 
         if (self.config["use_active_layers"]):
-            valid = True
-            """
-            for i in range(20):
-                if (node.layers[i] and self.scene.layers[i]):
-                    valid = True
-                    break
-            """
-            # use collections instead of layers
+            # Blender 2.8 replaced layers with collections, skip nodes in a
+            # hidden one. Collections are shared by many nodes, so only read
+            # the state of each once
             for col in node.users_collection:
-                if col.hide_viewport == True:
-                    valid = False
-                    break
-                    
-            if (not valid):
-                return False
+                hidden = self.collection_hidden.get(col)
+                if (hidden is None):
+                    hidden = self.collection_hidden[col] = col.hide_viewport
+                if (hidden):
+                    return False
 
         if (self.config["use_export_selected"] and not node.select_get()):
             return False
@@ -1612,15 +1781,26 @@ class DaeExporter:
             if (obj in self.valid_nodes):
                 continue
             if (self.is_node_valid(obj)):
+                # Parents of a valid node are valid too, once one is found
+                # in the set all of its parents are already there
                 n = obj
-                while (n is not None):
-                    if (n not in self.valid_nodes):
-                        self.valid_nodes.append(n)
+                while (n is not None and n not in self.valid_nodes):
+                    self.valid_nodes.add(n)
                     n = n.parent
 
-        for obj in sorted(self.scene.objects, key=lambda x: x.name):
-            if (obj in self.valid_nodes and obj.parent is None):                
-                self.export_node(obj, 2)
+        # Sort the valid children of every node by name once, export_node
+        # walks this table instead of sorting node.children itself
+        roots = []
+        for n in self.valid_nodes:
+            if (n.parent is None):
+                roots.append(n)
+            else:
+                self.node_children.setdefault(n.parent, []).append(n)
+        for children in self.node_children.values():
+            children.sort(key=lambda x: x.name)
+
+        for obj in sorted(roots, key=lambda x: x.name):
+            self.export_node(obj, 2)
 
         self.writel(S_NODES, 1, "</visual_scene>")
         self.writel(S_NODES, 0, "</library_visual_scenes>")
@@ -1642,112 +1822,29 @@ class DaeExporter:
         self.writel(S_ASSET, 1, "<up_axis>Z_UP</up_axis>")
         self.writel(S_ASSET, 0, "</asset>")
 
-    def export_animation_transform_channel(self, target, keys, matrices=True):
-        frame_total = len(keys)
+    def export_animation_transform_channel(self, target, source_frames,
+                                           source_interps, values,
+                                           matrices=True):
+        # The time and interpolation arrays are the same for every channel
+        # of an animation, they come in already formatted. The rest of the
+        # channel is a single template, written in one go
+        frame_total = len(values)
         anim_id = self.new_id("anim")
-        self.writel(S_ANIM, 1, "<animation id=\"{}\">".format(anim_id))
-        source_frames = ""
-        source_transforms = ""
-        source_interps = ""
-
-        for k in keys:
-            source_frames += " {}".format(k[0])
-            if (matrices):
-                source_transforms += " {}".format(strmtx(k[1]))
-            else:
-                source_transforms += " {}".format(k[1])
-
-            source_interps += " LINEAR"
-
-        # Time Source
-        self.writel(S_ANIM, 2, "<source id=\"{}-input\">".format(anim_id))
-        self.writel(
-            S_ANIM, 3, "<float_array id=\"{}-input-array\" "
-            "count=\"{}\">{}</float_array>".format(
-                anim_id, frame_total, source_frames))
-        self.writel(S_ANIM, 3, "<technique_common>")
-        self.writel(
-            S_ANIM, 4, "<accessor source=\"#{}-input-array\" "
-            "count=\"{}\" stride=\"1\">".format(anim_id, frame_total))
-        self.writel(S_ANIM, 5, "<param name=\"TIME\" type=\"float\"/>")
-        self.writel(S_ANIM, 4, "</accessor>")
-        self.writel(S_ANIM, 3, "</technique_common>")
-        self.writel(S_ANIM, 2, "</source>")
-
         if (matrices):
-            # Transform Source
-            self.writel(
-                S_ANIM, 2, "<source id=\"{}-transform-output\">".format(
-                    anim_id))
-            self.writel(
-                S_ANIM, 3, "<float_array id=\"{}-transform-output-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    anim_id, frame_total * 16, source_transforms))
-            self.writel(S_ANIM, 3, "<technique_common>")
-            self.writel(
-                S_ANIM, 4,
-                "<accessor source=\"#{}-transform-output-array\" count=\"{}\" "
-                "stride=\"16\">".format(anim_id, frame_total))
-            self.writel(
-                S_ANIM, 5, "<param name=\"TRANSFORM\" type=\"float4x4\"/>")
-            self.writel(S_ANIM, 4, "</accessor>")
-            self.writel(S_ANIM, 3, "</technique_common>")
-            self.writel(S_ANIM, 2, "</source>")
+            value_count = frame_total * 16
+            stride = 16
+            param = ANIMATION_PARAM_MATRIX
+            target = "{}/transform".format(target)
         else:
-            # Value Source
-            self.writel(
-                S_ANIM, 2,
-                "<source id=\"{}-transform-output\">".format(anim_id))
-            self.writel(
-                S_ANIM, 3, "<float_array id=\"{}-transform-output-array\" "
-                "count=\"{}\">{}</float_array>".format(
-                    anim_id, frame_total, source_transforms))
-            self.writel(S_ANIM, 3, "<technique_common>")
-            self.writel(
-                S_ANIM, 4, "<accessor source=\"#{}-transform-output-array\" "
-                "count=\"{}\" stride=\"1\">".format(anim_id, frame_total))
-            self.writel(S_ANIM, 5, "<param name=\"X\" type=\"float\"/>")
-            self.writel(S_ANIM, 4, "</accessor>")
-            self.writel(S_ANIM, 3, "</technique_common>")
-            self.writel(S_ANIM, 2, "</source>")
-
-        # Interpolation Source
-        self.writel(
-            S_ANIM, 2, "<source id=\"{}-interpolation-output\">".format(
-                anim_id))
-        self.writel(
-            S_ANIM, 3, "<Name_array id=\"{}-interpolation-output-array\" "
-            "count=\"{}\">{}</Name_array>".format(
-                anim_id, frame_total, source_interps))
-        self.writel(S_ANIM, 3, "<technique_common>")
-        self.writel(
-            S_ANIM, 4, "<accessor source=\"#{}-interpolation-output-array\" "
-            "count=\"{}\" stride=\"1\">".format(anim_id, frame_total))
-        self.writel(S_ANIM, 5, "<param name=\"INTERPOLATION\" type=\"Name\"/>")
-        self.writel(S_ANIM, 4, "</accessor>")
-        self.writel(S_ANIM, 3, "</technique_common>")
-        self.writel(S_ANIM, 2, "</source>")
-
-        self.writel(S_ANIM, 2, "<sampler id=\"{}-sampler\">".format(anim_id))
-        self.writel(
-            S_ANIM, 3,
-            "<input semantic=\"INPUT\" source=\"#{}-input\"/>".format(anim_id))
-        self.writel(
-            S_ANIM, 3, "<input semantic=\"OUTPUT\" "
-            "source=\"#{}-transform-output\"/>".format(anim_id))
-        self.writel(
-            S_ANIM, 3, "<input semantic=\"INTERPOLATION\" "
-            "source=\"#{}-interpolation-output\"/>".format(anim_id))
-        self.writel(S_ANIM, 2, "</sampler>")
-        if (matrices):
-            self.writel(
-                S_ANIM, 2, "<channel source=\"#{}-sampler\" "
-                "target=\"{}/transform\"/>".format(anim_id, target))
-        else:
-            self.writel(
-                S_ANIM, 2, "<channel source=\"#{}-sampler\" "
-                "target=\"{}\"/>".format(anim_id, target))
-        self.writel(S_ANIM, 1, "</animation>")
+            value_count = frame_total
+            stride = 1
+            param = ANIMATION_PARAM_VALUE
+
+        self.writel(S_ANIM, 0, ANIMATION_CHANNEL.format(
+            id=anim_id, count=frame_total, times=source_frames,
+            value_count=value_count,
+            values=floatarr(values.astype(np.float32)), stride=stride,
+            param=param, interps=source_interps, target=target))
 
         return [anim_id]
 
@@ -1755,8 +1852,8 @@ class DaeExporter:
         # TODO: Blender -> Collada frames needs a little work
         #       Collada starts from 0, blender usually from 1.
         #       The last frame must be included also
-
-        frame_orig = self.scene.frame_current
+        # The scene is left on the last sampled frame, export_animations
+        # restores the original one once all actions are exported
 
         frame_len = 1.0 / self.scene.render.fps
         frame_sub = 0
@@ -1764,125 +1861,165 @@ class DaeExporter:
             frame_sub = start * frame_len
 
         tcn = []
+        if (start > end):
+            return tcn
+
+        frame_total = end - start + 1
+        times = np.arange(start, end + 1) * frame_len - frame_sub
         xform_cache = {}
         blend_cache = {}
 
-        # Change frames first, export objects last, boosts performance
-        for t in range(start, end + 1):
-            self.scene.frame_set(t)
-            key = t * frame_len - frame_sub
-
-            for node in self.scene.objects:
-                if (node not in self.valid_nodes):
-                    continue
-                if (allowed is not None and not (node in allowed)):
-                    if (node.type == "MESH" and node.data is not None and
-                        (node in self.armature_for_morph) and (
-                            self.armature_for_morph[node] in allowed)):
-                        pass
-                    else:
-                        continue
+        def xform_channel(nid):
+            # Sampled matrices, the matrices of their parents and which
+            # samples have a parent to be made relative to
+            if (nid not in xform_cache):
+                xform_cache[nid] = (
+                    np.empty((frame_total, 4, 4)),
+                    np.empty((frame_total, 4, 4)),
+                    np.zeros(frame_total, dtype=bool))
+            return xform_cache[nid]
+
+        # Everything that does not change between frames is gathered once,
+        # along with the arrays its samples are written to
+        morph_samplers = []
+        node_samplers = []
+        bone_samplers = []
+        valid_nodes = self.valid_nodes
+        mesh_cache = self.mesh_cache
+        armature_for_morph = self.armature_for_morph
+        skeleton_info = self.skeleton_info
+        validate_id = self.validate_id
+        use_shape_key_export = self.config["use_shape_key_export"]
+        use_exclude_ctrl_bones = self.config["use_exclude_ctrl_bones"]
+        for node in self.scene.objects:
+            if (node not in valid_nodes):
+                continue
+            if (allowed is not None and not (node in allowed)):
                 if (node.type == "MESH" and node.data is not None and
-                    node.data.shape_keys is not None and (
-                        node.data in self.mesh_cache) and len(
-                            node.data.shape_keys.key_blocks) and self.config["use_shape_key_export"]):
-                    target = self.mesh_cache[node.data]["morph_id"]
-                    for i in range(len(node.data.shape_keys.key_blocks)):
-
-                        if (i == 0):
-                            continue
-
-                        name = "{}-morph-weights({})".format(target, i - 1)
-                        if (not (name in blend_cache)):
-                            blend_cache[name] = []
-
-                        blend_cache[name].append(
-                            (key, node.data.shape_keys.key_blocks[i].value))
-
-                if (node.type == "MESH" and node.parent and
-                        node.parent.type == "ARMATURE"):
-                    # In Collada, nodes that have skin modifier must not export
-                    # animation, animate the skin instead
+                    (node in armature_for_morph) and (
+                        armature_for_morph[node] in allowed)):
+                    pass
+                else:
                     continue
+            if (use_shape_key_export and node.type == "MESH" and
+                node.data is not None and
+                node.data.shape_keys is not None and (
+                    node.data in mesh_cache) and len(
+                        node.data.shape_keys.key_blocks)):
+                target = mesh_cache[node.data]["morph_id"]
+                key_blocks = node.data.shape_keys.key_blocks
+                for i in range(1, len(key_blocks)):
+                    name = "{}-morph-weights({})".format(target, i - 1)
+                    if (name not in blend_cache):
+                        blend_cache[name] = np.empty(
+                            frame_total, dtype=np.float32)
+                    morph_samplers.append((key_blocks[i], blend_cache[name]))
+
+            if (node.type == "MESH" and node.parent and
+                    node.parent.type == "ARMATURE"):
+                # In Collada, nodes that have skin modifier must not export
+                # animation, animate the skin instead
+                continue
+
+            if (len(node.constraints) > 0 or
+                    node.animation_data is not None):
+                # If the node has constraints, or animation data, then
+                # export a sampled animation track
+                name = validate_id(node.name)
+                node_samplers.append(
+                    (node, node.parent, xform_channel(name)))
+
+            if (node.type == "ARMATURE"):
+                bone_ids = skeleton_info[node]["bone_ids"]
+                bone_parents = skeleton_info[node]["bone_parents"]
+                # All bones exported for now
+                for bone in node.data.bones:
+                    if((bone.name.startswith("ctrl") or
+                        bone.use_deform == False) and
+                            use_exclude_ctrl_bones):
+                        continue
 
-                if (len(node.constraints) > 0 or
-                        node.animation_data is not None):
-                    # If the node has constraints, or animation data, then
-                    # export a sampled animation track
-                    name = self.validate_id(node.name)
-                    if (not (name in xform_cache)):
-                        xform_cache[name] = []
-
-                    mtx = node.matrix_world.copy()
-                    if (node.parent):
-                        mtx = node.parent.matrix_world.inverted_safe() @ mtx
-
-                    xform_cache[name].append((key, mtx))
-
-                if (node.type == "ARMATURE"):
-                    # All bones exported for now
-                    for bone in node.data.bones:
-                        if((bone.name.startswith("ctrl") or
-                            bone.use_deform == False) and
-                                self.config["use_exclude_ctrl_bones"]):
-                            continue
-
-                        bone_name = self.skeleton_info[node]["bone_ids"][bone]
-
-                        if (not (bone_name in xform_cache)):
-                            xform_cache[bone_name] = []
-
-                        posebone = node.pose.bones[bone.name]
-                        parent_posebone = None
-
-                        mtx = posebone.matrix.copy()
-                        if (bone.parent):
-                            if (self.config["use_exclude_ctrl_bones"]):
-                                current_parent_posebone = bone.parent
-                                while ((current_parent_posebone.name
-                                        .startswith("ctrl") or
-                                        current_parent_posebone.use_deform
-                                        == False) and
-                                        current_parent_posebone.parent):
-                                    current_parent_posebone = (
-                                        current_parent_posebone.parent)
-                                parent_posebone = node.pose.bones[
-                                    current_parent_posebone.name]
-                            else:
-                                parent_posebone = node.pose.bones[
-                                    bone.parent.name]
-                            parent_invisible = False
-
-                            for i in range(3):
-                                if (parent_posebone.scale[i] == 0.0):
-                                    parent_invisible = True
-
-                            if (not parent_invisible):
-                                mtx = (
-                                    parent_posebone.matrix
-                                    .inverted_safe() @ mtx)
-
-                        xform_cache[bone_name].append((key, mtx))
-
-        self.scene.frame_set(frame_orig)
+                    posebone = node.pose.bones[bone.name]
+                    parent_posebone = None
+
+                    parent = bone_parents[bone.name]
+                    if (parent):
+                        parent_posebone = node.pose.bones[parent.name]
+
+                    bone_samplers.append(
+                        (posebone, parent_posebone,
+                         xform_channel(bone_ids[bone])))
+
+        # Nothing is animated, don't step through the frames for nothing
+        if (not (morph_samplers or node_samplers or bone_samplers)):
+            return tcn
+
+        # Change frames first, export objects last, boosts performance.
+        # Blender data can only be read from this thread while the frame is
+        # set, so the loop only copies matrices into the channel arrays.
+        # Relative transforms are resolved after.
+        frame_set = self.scene.frame_set
+        for f, t in enumerate(range(start, end + 1)):
+            frame_set(t)
+
+            for key_block, values in morph_samplers:
+                values[f] = key_block.value
+
+            for node, parent, (mtx, parent_mtx, parented) in node_samplers:
+                mtx[f] = node.matrix_world
+                if (parent):
+                    parent_mtx[f] = parent.matrix_world
+                    parented[f] = True
+
+            for posebone, parent_posebone, channel in bone_samplers:
+                mtx, parent_mtx, parented = channel
+                mtx[f] = posebone.matrix
+                # A parent scaled to zero on any axis can't be inverted
+                if (parent_posebone is not None and
+                        0.0 not in parent_posebone.scale):
+                    parent_mtx[f] = parent_posebone.matrix
+                    parented[f] = True
+
+        # Make the captured matrices relative to their parents, one batch
+        # per channel with the same fallback as in export_armature_node
+        for mtx, parent_mtx, parented in xform_cache.values():
+            if (not parented.any()):
+                continue
+            try:
+                mtx[parented] = (
+                    np.linalg.inv(parent_mtx[parented]) @ mtx[parented])
+            except np.linalg.LinAlgError:
+                for i in np.flatnonzero(parented):
+                    mtx[i] = (
+                        Matrix(parent_mtx[i].tolist()).inverted_safe() @
+                        Matrix(mtx[i].tolist()))
 
         # Export animation XML
-        for nid in xform_cache:
+        source_frames = floatarr(times)
+        source_interps = " LINEAR" * frame_total
+        for nid, (mtx, parent_mtx, parented) in xform_cache.items():
             tcn += self.export_animation_transform_channel(
-                nid, xform_cache[nid], True)
-        for nid in blend_cache:
+                nid, source_frames, source_interps, mtx, True)
+        for nid, values in blend_cache.items():
             tcn += self.export_animation_transform_channel(
-                nid, blend_cache[nid], False)
+                nid, source_frames, source_interps, values, False)
 
         return tcn
 
     def export_animations(self):
+        frame_orig = self.scene.frame_current
+        frame_changed = False
+
+        # Assigning a matrix copies its values, one identity serves every
+        # pose bone reset below
+        identity = Matrix()
+
         tmp_mat = []
         for s in self.skeletons:
             tmp_bone_mat = []
             for bone in s.pose.bones:
                 tmp_bone_mat.append(Matrix(bone.matrix_basis))
-                bone.matrix_basis = Matrix()
+                bone.matrix_basis = identity
             tmp_mat.append([Matrix(s.matrix_local), tmp_bone_mat])
 
         self.writel(S_ANIM, 0, "<library_animations>")
@@ -1890,6 +2027,7 @@ class DaeExporter:
         if (self.config["use_anim_action_all"] and len(self.skeletons)):
 
             cached_actions = {}
+            framelen = (1.0 / self.scene.render.fps)
 
             for s in self.skeletons:
                 if s.animation_data and s.animation_data.action:
@@ -1905,42 +2043,41 @@ class DaeExporter:
                         x.name.endswith("-noexp")):
                     continue
                            
-                bones = []
+                bones = set()
                 # Find bones used
+                base = "pose.bones[\""
                 for p in x.fcurves:
                     dp = p.data_path
-                    base = "pose.bones[\""
                     if dp.startswith(base):
-                        dp = dp[len(base):]
-                        if (dp.find("\"") != -1):
-                            dp = dp[:dp.find("\"")]
-                            if (dp not in bones):
-                                bones.append(dp)
+                        end = dp.find("\"", len(base))
+                        if (end != -1):
+                            bones.add(dp[len(base):end])
 
-                allowed_skeletons = []
+                allowed_skeletons = set()
                 for i, y in enumerate(self.skeletons):
                     if (y.animation_data):
-                        for z in y.pose.bones:
-                            if (z.bone.name in bones):
-                                if (y not in allowed_skeletons):
-                                    allowed_skeletons.append(y)
+                        if (not bones.isdisjoint(
+                                z.bone.name for z in y.pose.bones)):
+                            allowed_skeletons.add(y)
                         y.animation_data.action = x
 
                         y.matrix_local = tmp_mat[i][0]
                         for j, bone in enumerate(s.pose.bones):
-                            bone.matrix_basis = Matrix()
+                            bone.matrix_basis = identity
 
                 tcn = self.export_animation(int(x.frame_range[0]), int(
                     x.frame_range[1] + 0.5), allowed_skeletons)
-                framelen = (1.0 / self.scene.render.fps)
+                frame_changed = frame_changed or len(tcn) > 0
                 start = x.frame_range[0] * framelen
                 end = x.frame_range[1] * framelen
                 self.writel(
                     S_ANIM_CLIPS, 1, "<animation_clip name=\"{}\" "
-                    "start=\"{}\" end=\"{}\">".format(x.name, start, end))
-                for z in tcn:
-                    self.writel(S_ANIM_CLIPS, 2,
-                                "<instance_animation url=\"#{}\"/>".format(z))
+                    "start=\"{}\" end=\"{}\">".format(
+                        xmlattr(x.name), start, end))
+                if (tcn):
+                    self.writel(S_ANIM_CLIPS, 0, indented(
+                        (2, "<instance_animation url=\"#{}\"/>".format(z))
+                        for z in tcn))
                 self.writel(S_ANIM_CLIPS, 1, "</animation_clip>")
                 if (len(tcn) == 0):
                     self.operator.report(
@@ -1961,7 +2098,13 @@ class DaeExporter:
                         bone.matrix_basis = tmp_mat[i][1][j]
 
         else:
-            self.export_animation(self.scene.frame_start, self.scene.frame_end)
+            tcn = self.export_animation(
+                self.scene.frame_start, self.scene.frame_end)
+            frame_changed = len(tcn) > 0
+
+        # Frames are only stepped through when something got sampled
+        if (frame_changed):
+            self.scene.frame_set(frame_orig)
 
         self.writel(S_ANIM, 0, "</library_animations>")
 
@@ -1981,13 +2124,11 @@ class DaeExporter:
 
         # Morphs always go before skin controllers
         if S_MORPH in self.sections:
-            for l in self.sections[S_MORPH]:
-                self.writel(S_CONT, 0, l)
+            self.sections[S_CONT].extend(self.sections[S_MORPH])
             del self.sections[S_MORPH]
 
         if S_SKIN in self.sections:
-            for l in self.sections[S_SKIN]:
-                self.writel(S_CONT, 0, l)
+            self.sections[S_CONT].extend(self.sections[S_SKIN])
             del self.sections[S_SKIN]
 
         self.writel(S_CONT, 0, "</library_controllers>")
@@ -1999,58 +2140,70 @@ class DaeExporter:
 
         self.purge_empty_nodes()
 
-        if (self.config["use_anim"]):
-            self.export_animations()
-
+        # The document is written next to the target and only replaces it
+        # once complete, a failing animation export leaves it untouched
+        tmp_path = "{}.tmp".format(self.path)
         try:
-            f = open(self.path, "wb")
+            f = open(tmp_path, "wb", buffering=WRITE_BUFFER_SIZE)
         except:
             return False
 
-        f.write(bytes("<?xml version=\"1.0\" encoding=\"utf-8\"?>\n", "UTF-8"))
-        f.write(bytes(
-            "<COLLADA xmlns=\"http://www.collada.org/2005/11/COLLADASchema\" "
-            "version=\"1.4.1\">\n", "UTF-8"))
-
-        s = []
-        for x in self.sections.keys():
-            s.append(x)
-        s.sort()
-        for x in s:
-            for l in self.sections[x]:
-                f.write(bytes(l + "\n", "UTF-8"))
-
-        f.write(bytes("<scene>\n", "UTF-8"))
-        f.write(bytes(
-            "\t<instance_visual_scene url=\"#{}\" />\n".format(
-                self.scene_name), "UTF-8"))
-        f.write(bytes("</scene>\n", "UTF-8"))
-        f.write(bytes("</COLLADA>\n", "UTF-8"))
+        try:
+            with f:
+                f.write(DOCUMENT_HEADER)
+
+                # Every library before the animation clips is complete,
+                # write them out before sampling animations instead of
+                # keeping them
+                self.write_sections(f, S_ANIM_CLIPS)
+
+                if (self.config["use_anim"]):
+                    self.export_animations()
+
+                self.write_sections(f)
+
+                f.write(
+                    DOCUMENT_FOOTER.format(self.scene_name).encode("utf-8"))
+            os.replace(tmp_path, self.path)
+        except:
+            os.remove(tmp_path)
+            raise
         return True
 
     __slots__ = ("operator", "scene", "last_id", "scene_name", "sections",
                  "path", "mesh_cache", "curve_cache", "material_cache",
                  "image_cache", "skeleton_info", "config", "valid_nodes",
                  "armature_for_morph", "used_bones", "wrongvtx_report",
-                 "skeletons", "action_constraints", "temp_meshes")
+                 "skeletons", "action_constraints", "temp_meshes",
+                 "output_dir", "copied_images", "dirs_created",
+                 "files_known", "collection_hidden", "aspect_ratio",
+                 "node_children")
 
     def __init__(self, path, kwargs, operator):
         self.operator = operator
         self.scene = bpy.context.scene
+        self.aspect_ratio = (self.scene.render.resolution_x /
+                             self.scene.render.resolution_y)
         self.last_id = 0
         self.scene_name = self.new_id("scene")
         self.sections = {}
         self.path = path
+        self.output_dir = os.path.dirname(path)
         self.mesh_cache = {}
         self.temp_meshes = set()
         self.curve_cache = {}
         self.material_cache = {}
         self.image_cache = {}
+        self.copied_images = set()
+        self.dirs_created = set()
+        self.files_known = {}
+        self.collection_hidden = {}
         self.skeleton_info = {}
         self.config = kwargs
-        self.valid_nodes = []
+        self.valid_nodes = set()
+        self.node_children = {}
         self.armature_for_morph = {}
-        self.used_bones = []
+        self.used_bones = set()
         self.wrongvtx_report = False
         self.skeletons = []
         self.action_constraints = []